@@ -2,29 +2,59 @@
 """Flask backend for PDF metadata + image extraction + OCR benchmarking."""
 
 import os
-import io
+import re
 import json
 import uuid
 import time
-import base64
+import mmap
+import binascii
 import shutil
+import functools
+import gc
+import zipfile
 import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import fitz  # PyMuPDF
 import boto3
+import orjson
 from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 import pytesseract
 from PIL import Image as PILImage
-from flask import Flask, request, jsonify, send_from_directory
+from flask import (
+    Flask, Response, request, jsonify, send_from_directory, stream_with_context,
+)
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
 
+try:
+    from tesserocr import OEM, PSM, PyTessBaseAPI  # in-process libtesseract, no fork per page
+except ImportError:
+    PyTessBaseAPI = None
+
 app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
 
 UPLOAD_DIR = "/data/uploads"
 EXTRACT_DIR = "/data/extracted"
 ALLOWED_EXTENSIONS = {"pdf"}
+MAX_SIZE = 50 * 1024 * 1024  # matches nginx client_max_body_size
+
+# Images with fewer pixels than this are skipped without being decoded
+MIN_IMAGE_PIXELS = 64
+
+# Image formats that are already entropy-coded; zipping them again is wasted CPU
+PRECOMPRESSED_EXTS = {".png", ".jpg", ".jpeg", ".jpx", ".jp2", ".jb2", ".gif", ".webp"}
+
+# When set (e.g. "/internal"), images are handed off to nginx via X-Accel-Redirect
+X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX", "").rstrip("/")
+
+# Keep tesseract's OpenMP to one thread; throughput comes from running
+# pages/images side by side instead of threads contending on one page.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(EXTRACT_DIR, exist_ok=True)
@@ -35,6 +65,15 @@ LAMBDA_FUNCTION_NAME = os.environ.get("LAMBDA_FUNCTION_NAME", "ocr-extract-text"
 LAMBDA_IMAGE_URI = os.environ.get("LAMBDA_IMAGE_URI", "ocr-lambda:latest")
 AWS_REGION = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
 
+# Render resolution for the direct-Tesseract OCR path
+OCR_DPI = int(os.environ.get("OCR_DPI", "200"))
+
+# Batched Lambda OCR: keep each invoke under the 6 MB synchronous payload
+# limit and short enough (the Lambda OCRs its batch serially) to finish
+# inside the client's read_timeout; sub-batches run side by side.
+LAMBDA_BATCH_MAX_BYTES = int(os.environ.get("LAMBDA_BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+LAMBDA_BATCH_MAX_IMAGES = int(os.environ.get("LAMBDA_BATCH_MAX_IMAGES", "8"))
+
 lambda_client = None
 _lambda_deployed = False
 
@@ -143,10 +182,148 @@ def ensure_lambda_deployed(force=False):
         return False, msg
 
 
+# ──────────────────────────────────────────────
+#  Direct Tesseract OCR
+# ──────────────────────────────────────────────
+
+# LSTM engine only, one uniform text block: skips the legacy engine and the
+# page layout analysis, and matches what the Lambda runs.
+TESS_CONFIG = "--oem 1 --psm 6"
+
+_tess_local = threading.local()
+
+
+def ocr_page_image(pil_img):
+    """OCR a PIL image in-process via tesserocr, else through pytesseract's CLI."""
+    if PyTessBaseAPI is None:
+        return pytesseract.image_to_string(pil_img, lang="eng", config=TESS_CONFIG)
+    # One API (and one loaded model) per thread; instances are not thread-safe
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = _tess_local.api = PyTessBaseAPI(
+            lang="eng", psm=PSM.SINGLE_BLOCK, oem=OEM.LSTM_ONLY)
+    api.SetImage(pil_img)
+    return api.GetUTF8Text()
+
+
+# ──────────────────────────────────────────────
+#  Lambda OCR payloads
+# ──────────────────────────────────────────────
+
+# Multiple of 3 so chunks base64-encode without intermediate padding
+B64_CHUNK = 57 * 1024
+
+
+def b64_file(path):
+    """Base64-encode a file from an mmap in chunks, returning bytes (no str copy)."""
+    out = bytearray()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return bytes(out)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+            for i in range(0, len(mv), B64_CHUNK):
+                out += binascii.b2a_base64(mv[i:i + B64_CHUNK], newline=False)
+    return bytes(out)
+
+
+def split_batches(images_dir, files):
+    """Group files into sub-batches capped by encoded payload size and image count."""
+    batches, batch, size = [], [], 0
+    for f in files:
+        # base64 grows 4/3; the JSON wrapper and name add a little more
+        encoded = 4 * -(-os.path.getsize(os.path.join(images_dir, f)) // 3) + len(f) + 64
+        if batch and (size + encoded > LAMBDA_BATCH_MAX_BYTES
+                      or len(batch) >= LAMBDA_BATCH_MAX_IMAGES):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(f)
+        size += encoded
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def image_payload(img_path, img_file):
+    """JSON object for one image, spliced as bytes so the base64 never becomes a str."""
+    ext = img_file.rsplit(".", 1)[-1] if "." in img_file else "png"
+    return b"".join([
+        b'{"image_b64": "', b64_file(img_path),
+        b'", "image_ext": ', orjson.dumps(ext),
+        b', "image_name": ', orjson.dumps(img_file), b"}",
+    ])
+
+
+# ──────────────────────────────────────────────
+#  /CustomFields parsing
+# ──────────────────────────────────────────────
+
+_PDF_STRING_TOKEN = re.compile(rb"\\.|[()]", re.DOTALL)
+_PDF_ESCAPE = re.compile(rb"\\(?:([0-7]{1,3})|(.))", re.DOTALL)
+_PDF_ESCAPE_MAP = {
+    b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f",
+}
+
+
+def _unescape_pdf_string(match):
+    octal, char = match.groups()
+    if octal:
+        return bytes([int(octal, 8) & 0xFF])
+    return _PDF_ESCAPE_MAP.get(char, char)
+
+
+def parse_custom_fields(raw):
+    """Return the JSON object stored in the /CustomFields literal string, or None."""
+    idx = raw.find(b"/CustomFields")
+    if idx == -1:
+        return None
+    paren_start = raw.index(b"(", idx + len(b"/CustomFields"))
+
+    # Jump between parens/escapes instead of walking every byte.
+    depth = 1
+    for m in _PDF_STRING_TOKEN.finditer(raw, paren_start + 1):
+        tok = m.group()
+        if tok == b"(":
+            depth += 1
+        elif tok == b")":
+            depth -= 1
+            if depth == 0:
+                segment = raw[paren_start + 1:m.start()]
+                break
+    else:
+        raise ValueError("Unterminated /CustomFields string")
+
+    return json.loads(_PDF_ESCAPE.sub(_unescape_pdf_string, segment).decode("latin-1"))
+
+
+class _ZipStream:
+    """Write-only sink for ZipFile; the response generator drains it per entry."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
 # ──────────────────────────────────────────────
 #  Routes
 # ──────────────────────────────────────────────
 
+@functools.lru_cache(maxsize=4096)
+def _safe(name):
+    """Memoized secure_filename for the per-request job/image path parts."""
+    return secure_filename(name)
+
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -192,7 +369,10 @@ def lambda_status():
 
 @app.route("/api/extract", methods=["POST"])
 def extract_pdf():
-    """Upload a PDF, extract metadata, custom JSON fields, and all images."""
+    """Upload a PDF, extract metadata, custom JSON fields, and all images.
+
+    Per-page text is only extracted with ?includeText=1.
+    """
 
     if "file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
@@ -201,19 +381,29 @@ def extract_pdf():
     if file.filename == "" or not allowed_file(file.filename):
         return jsonify({"error": "Invalid file. PDF only."}), 400
 
+    include_text = request.args.get("includeText", "0") == "1"
+
+    # Read the upload once (one byte past the limit is enough to reject it)
+    pdf_bytes = file.stream.read(MAX_SIZE + 1)
+    if len(pdf_bytes) > MAX_SIZE:
+        return jsonify({"error": f"File exceeds {MAX_SIZE // (1024 * 1024)} MB"}), 413
+
     # Create unique job directory
     job_id = uuid.uuid4().hex[:12]
     job_dir = os.path.join(EXTRACT_DIR, job_id)
     images_dir = os.path.join(job_dir, "images")
     os.makedirs(images_dir, exist_ok=True)
 
-    # Save uploaded PDF
+    # The copy on disk is only kept for /api/ocr
     safe_name = secure_filename(file.filename)
     pdf_path = os.path.join(job_dir, safe_name)
-    file.save(pdf_path)
+    Path(pdf_path).write_bytes(pdf_bytes)
+
+    # Image files are written in the background while the next pages decode
+    writer_pool = ThreadPoolExecutor(max_workers=4)
 
     try:
-        doc = fitz.open(pdf_path)
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
 
         # ── Standard metadata ──
         meta = doc.metadata or {}
@@ -229,70 +419,45 @@ def extract_pdf():
             "format": meta.get("format", ""),
             "encryption": meta.get("encryption") or "None",
             "pageCount": doc.page_count,
-            "fileSize": os.path.getsize(pdf_path),
+            "fileSize": len(pdf_bytes),
             "fileName": safe_name,
         }
 
         # ── Custom fields from /CustomFields JSON ──
         custom_fields = None
         try:
-            with open(pdf_path, "rb") as f:
-                raw = f.read().decode("latin1")
-
-            marker = "/CustomFields"
-            idx = raw.find(marker)
-            if idx != -1:
-                search_from = idx + len(marker)
-                paren_start = raw.index("(", search_from)
-
-                depth = 1
-                content = []
-                i = paren_start + 1
-                while i < len(raw) and depth > 0:
-                    ch = raw[i]
-                    if ch == "\\" and i + 1 < len(raw):
-                        nxt = raw[i + 1]
-                        if "0" <= nxt <= "7":
-                            octal = ""
-                            j = i + 1
-                            while j < len(raw) and j < i + 4 and "0" <= raw[j] <= "7":
-                                octal += raw[j]
-                                j += 1
-                            content.append(chr(int(octal, 8)))
-                            i = j
-                            continue
-                        esc_map = {
-                            "(": "(", ")": ")", "\\": "\\",
-                            "n": "\n", "r": "\r", "t": "\t",
-                        }
-                        content.append(esc_map.get(nxt, nxt))
-                        i += 2
-                        continue
-                    if ch == "(":
-                        depth += 1
-                        content.append(ch)
-                    elif ch == ")":
-                        depth -= 1
-                        if depth > 0:
-                            content.append(ch)
-                    else:
-                        content.append(ch)
-                    i += 1
-
-                custom_fields = json.loads("".join(content))
+            custom_fields = parse_custom_fields(pdf_bytes)
         except Exception as e:
             app.logger.warning("Could not extract custom fields: %s", e)
 
-        # ── Image extraction ──
+        # ── Image + text extraction (single pass over the pages) ──
+        # PyMuPDF documents are not thread-safe, so pages are walked
+        # serially; text and images share the one page load.
         extracted_images = []
+        # Text layout analysis is opt-in (?includeText=1); otherwise pdfText is null
+        pdf_text_pages = [] if include_text else None
         img_counter = 0
+        # xref -> image entry (None if skipped); shared images such as logos
+        # are decoded and written once, then re-linked on later pages.
+        seen_xrefs = {}
+        pending_writes = []
 
         for page_num in range(doc.page_count):
             page = doc[page_num]
+            if include_text:
+                pdf_text_pages.append(page.get_text())
             image_list = page.get_images(full=True)
 
             for img_idx, img_info in enumerate(image_list):
                 xref = img_info[0]
+                if xref in seen_xrefs:
+                    if seen_xrefs[xref] is not None:
+                        extracted_images.append({**seen_xrefs[xref], "page": page_num + 1})
+                    continue
+                seen_xrefs[xref] = None
+                # Decorative specks (1x1 spacers etc.): skip before decoding
+                if img_info[2] * img_info[3] < MIN_IMAGE_PIXELS:
+                    continue
                 try:
                     base_image = doc.extract_image(xref)
                     if not base_image:
@@ -313,10 +478,10 @@ def extract_pdf():
                     img_filename = f"page{page_num + 1}_img{img_counter}.{img_ext}"
                     img_path = os.path.join(images_dir, img_filename)
 
-                    with open(img_path, "wb") as f:
-                        f.write(img_bytes)
+                    pending_writes.append(
+                        writer_pool.submit(Path(img_path).write_bytes, img_bytes))
 
-                    extracted_images.append({
+                    seen_xrefs[xref] = {
                         "filename": img_filename,
                         "page": page_num + 1,
                         "width": width,
@@ -326,20 +491,18 @@ def extract_pdf():
                         "size": img_size,
                         "ext": img_ext,
                         "url": f"/api/images/{job_id}/{img_filename}",
-                    })
+                    }
+                    extracted_images.append(seen_xrefs[xref])
                 except Exception as e:
                     app.logger.warning(
                         "Failed to extract image xref=%s page=%s: %s",
                         xref, page_num, e,
                     )
 
-        # ── Extract text directly from PDF (PyMuPDF built-in) ──
-        pdf_text_pages = []
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            pdf_text_pages.append(page.get_text())
-
         doc.close()
+        writer_pool.shutdown(wait=True)
+        for fut in pending_writes:
+            fut.result()
 
         return jsonify({
             "jobId": job_id,
@@ -351,6 +514,7 @@ def extract_pdf():
         })
 
     except Exception as e:
+        writer_pool.shutdown(wait=True)
         shutil.rmtree(job_dir, ignore_errors=True)
         return jsonify({"error": f"Failed to process PDF: {str(e)}"}), 500
 
@@ -363,10 +527,11 @@ def extract_pdf():
 def ocr_benchmark(job_id):
     """
     Run two OCR strategies and return timing comparison:
-      1. Lambda per-image: invoke Lambda for each extracted image
+      1. Lambda per-image: OCR the extracted images in size-capped batches,
+         invoked concurrently (?lambdaMode=serial invokes once per image)
       2. Direct Tesseract: OCR on each PDF page rendered as an image
     """
-    safe_job = secure_filename(job_id)
+    safe_job = _safe(job_id)
     job_dir = os.path.join(EXTRACT_DIR, safe_job)
     images_dir = os.path.join(job_dir, "images")
 
@@ -385,6 +550,9 @@ def ocr_benchmark(job_id):
 
     results = {}
 
+    # "batch" packs images into size-capped invokes; "serial" invokes once per image
+    lambda_mode = request.args.get("lambdaMode", "batch").lower()
+
     # ────────────────────────────────────────
     #  Strategy 1: Lambda per-image OCR
     # ────────────────────────────────────────
@@ -405,26 +573,15 @@ def ocr_benchmark(job_id):
             if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".gif"))
         ])
 
-        for img_file in image_files:
-            img_path = os.path.join(images_dir, img_file)
-            ext = img_file.rsplit(".", 1)[-1] if "." in img_file else "png"
-
-            with open(img_path, "rb") as f:
-                img_b64 = base64.b64encode(f.read()).decode("utf-8")
-
-            payload = {
-                "image_b64": img_b64,
-                "image_ext": ext,
-                "image_name": img_file,
-            }
+        def _invoke_one(img_file):
+            payload = image_payload(os.path.join(images_dir, img_file), img_file)
 
             call_start = time.time()
             try:
-                client = get_lambda_client()
                 resp = client.invoke(
                     FunctionName=LAMBDA_FUNCTION_NAME,
                     InvocationType="RequestResponse",
-                    Payload=json.dumps(payload),
+                    Payload=payload,
                 )
 
                 raw_payload = resp["Payload"].read().decode("utf-8")
@@ -433,44 +590,107 @@ def ocr_benchmark(job_id):
                 if resp.get("FunctionError"):
                     app.logger.warning("Lambda FunctionError for %s: %s",
                                        img_file, raw_payload[:300])
-                    lambda_errors.append({
-                        "image_name": img_file,
-                        "error": f"FunctionError: {raw_payload[:200]}",
-                    })
-                    lambda_results.append({
+                    return {
                         "image_name": img_file,
                         "text": "",
                         "lambda_internal_ms": 0,
                         "roundtrip_ms": call_elapsed,
                         "error": f"FunctionError: {raw_payload[:200]}",
-                    })
-                    continue
+                    }
 
-                resp_payload = json.loads(raw_payload)
+                resp_payload = orjson.loads(raw_payload)
 
                 if isinstance(resp_payload.get("body"), str):
-                    body = json.loads(resp_payload["body"])
+                    body = orjson.loads(resp_payload["body"])
                 else:
                     body = resp_payload
 
-                lambda_results.append({
+                return {
                     "image_name": img_file,
                     "text": body.get("text", ""),
                     "lambda_internal_ms": body.get("elapsed_ms", 0),
                     "roundtrip_ms": call_elapsed,
-                })
+                }
             except Exception as e:
                 call_elapsed = round((time.time() - call_start) * 1000, 2)
                 app.logger.warning("Lambda invoke failed for %s (%.0fms): %s",
                                    img_file, call_elapsed, e)
-                lambda_errors.append({"image_name": img_file, "error": str(e)})
-                lambda_results.append({
+                return {
                     "image_name": img_file,
                     "text": "",
                     "lambda_internal_ms": 0,
                     "roundtrip_ms": call_elapsed,
                     "error": str(e),
-                })
+                }
+
+        def _invoke_batch(files):
+            payload = b"".join([
+                b'{"images": [',
+                b", ".join(image_payload(os.path.join(images_dir, f), f) for f in files),
+                b"]}",
+            ])
+
+            call_start = time.time()
+            try:
+                resp = client.invoke(
+                    FunctionName=LAMBDA_FUNCTION_NAME,
+                    InvocationType="RequestResponse",
+                    Payload=payload,
+                )
+                raw_payload = resp["Payload"].read().decode("utf-8")
+                call_elapsed = round((time.time() - call_start) * 1000, 2)
+
+                if resp.get("FunctionError"):
+                    app.logger.warning("Lambda FunctionError for batch: %s",
+                                       raw_payload[:300])
+                    error = f"FunctionError: {raw_payload[:200]}"
+                    batch = []
+                else:
+                    resp_payload = orjson.loads(raw_payload)
+                    if isinstance(resp_payload.get("body"), str):
+                        body = orjson.loads(resp_payload["body"])
+                    else:
+                        body = resp_payload
+                    error = None
+                    batch = body.get("results", [])
+            except Exception as e:
+                call_elapsed = round((time.time() - call_start) * 1000, 2)
+                app.logger.warning("Lambda batch invoke failed (%.0fms): %s",
+                                   call_elapsed, e)
+                error = str(e)
+                batch = []
+
+            by_name = {r.get("image_name"): r for r in batch}
+            out = []
+            for img_file in files:
+                r = by_name.get(img_file)
+                item = {
+                    "image_name": img_file,
+                    "text": r.get("text", "") if r else "",
+                    "lambda_internal_ms": r.get("elapsed_ms", 0) if r else 0,
+                    "roundtrip_ms": call_elapsed,
+                }
+                if r is None or "error" in r:
+                    item["error"] = r["error"] if r else (error or "Missing from batch response")
+                out.append(item)
+            return out
+
+        if image_files:
+            client = get_lambda_client()
+            if lambda_mode == "serial":
+                # boto3 clients are thread-safe for invoke; the calls are
+                # network-bound so they can all be in flight at once.
+                with ThreadPoolExecutor(max_workers=min(16, len(image_files))) as ex:
+                    lambda_results = list(ex.map(_invoke_one, image_files))
+            else:
+                batches = split_batches(images_dir, image_files)
+                with ThreadPoolExecutor(max_workers=min(16, len(batches))) as ex:
+                    lambda_results = [r for batch in ex.map(_invoke_batch, batches) for r in batch]
+
+        lambda_errors.extend(
+            {"image_name": r["image_name"], "error": r["error"]}
+            for r in lambda_results if "error" in r
+        )
     elif not deploy_ok:
         lambda_errors.append({
             "image_name": "(all)",
@@ -485,6 +705,7 @@ def ocr_benchmark(job_id):
         "imageCount": len(lambda_results),
         "errors": lambda_errors,
         "deployMessage": lambda_deploy_msg,
+        "mode": lambda_mode,
     }
 
     # ────────────────────────────────────────
@@ -501,13 +722,18 @@ def ocr_benchmark(job_id):
             try:
                 page = doc[page_num]
 
-                # Render page to image at 300 DPI
-                mat = fitz.Matrix(300 / 72, 300 / 72)
-                pix = page.get_pixmap(matrix=mat)
-                img_bytes = pix.tobytes("png")
+                # Render page straight to a grayscale buffer (no PNG round-trip)
+                mat = fitz.Matrix(OCR_DPI / 72, OCR_DPI / 72)
+                pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
 
-                pil_img = PILImage.open(io.BytesIO(img_bytes))
-                text = pytesseract.image_to_string(pil_img, lang="eng")
+                pil_img = PILImage.frombytes("L", (pix.width, pix.height), pix.samples)
+                text = ocr_page_image(pil_img)
+
+                # Drop this page's buffers before rendering the next one
+                pil_img.close()
+                del pil_img, pix
+                if page_num % 10 == 9:
+                    gc.collect()
 
                 page_elapsed = round((time.time() - page_start) * 1000, 2)
 
@@ -558,32 +784,49 @@ def ocr_benchmark(job_id):
 @app.route("/api/images/<job_id>/<filename>", methods=["GET"])
 def serve_image(job_id, filename):
     """Serve an extracted image."""
-    safe_job = secure_filename(job_id)
-    safe_file = secure_filename(filename)
+    safe_job = _safe(job_id)
+    safe_file = _safe(filename)
     images_dir = os.path.join(EXTRACT_DIR, safe_job, "images")
 
-    if not os.path.isfile(os.path.join(images_dir, safe_file)):
-        return jsonify({"error": "Image not found"}), 404
+    if X_ACCEL_PREFIX:
+        # Let nginx sendfile() the image straight from the shared volume
+        resp = app.response_class()
+        resp.headers["X-Accel-Redirect"] = f"{X_ACCEL_PREFIX}/{safe_job}/images/{safe_file}"
+        return resp
 
-    return send_from_directory(images_dir, safe_file)
+    try:
+        return send_from_directory(images_dir, safe_file,
+                                   conditional=True, etag=True, max_age=3600)
+    except NotFound:
+        return jsonify({"error": "Image not found"}), 404
 
 
 @app.route("/api/images/<job_id>/download-all", methods=["GET"])
 def download_all_images(job_id):
     """Download all extracted images as a zip."""
-    safe_job = secure_filename(job_id)
+    safe_job = _safe(job_id)
     job_dir = os.path.join(EXTRACT_DIR, safe_job)
     images_dir = os.path.join(job_dir, "images")
 
     if not os.path.isdir(images_dir):
         return jsonify({"error": "Job not found"}), 404
 
-    zip_path = os.path.join(job_dir, "extracted_images")
-    shutil.make_archive(zip_path, "zip", images_dir)
-
-    return send_from_directory(job_dir, "extracted_images.zip",
-                               as_attachment=True,
-                               download_name="extracted_images.zip")
+    def generate():
+        sink = _ZipStream()
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+            for name in sorted(os.listdir(images_dir)):
+                ext = os.path.splitext(name)[1].lower()
+                zf.write(os.path.join(images_dir, name), arcname=name,
+                         compress_type=(zipfile.ZIP_STORED if ext in PRECOMPRESSED_EXTS
+                                        else zipfile.ZIP_DEFLATED))
+                yield sink.drain()
+        yield sink.drain()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=extracted_images.zip"},
+    )
 
 
 if __name__ == "__main__":
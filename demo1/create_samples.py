@@ -8,8 +8,10 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.colors import HexColor
 from pypdf import PdfReader, PdfWriter
 from PIL import Image as PILImage, ImageDraw, ImageFont
+import io
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
 IMAGES_DIR = os.path.join(OUTPUT_DIR, "source_images")
@@ -71,9 +73,15 @@ def _lighten(hex_color, amount=0.25):
     return f"#{r:02x}{g:02x}{b:02x}"
 
 
-def create_pdf_with_images(filename, title, paragraphs, images_spec):
-    """Create PDF with text content and embedded images."""
-    doc = SimpleDocTemplate(filename, pagesize=letter)
+def create_pdf_with_images(filename, title, paragraphs, images_spec, standard_meta, custom_fields):
+    """Create PDF with text content, embedded images and metadata."""
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buf, pagesize=letter,
+        title=standard_meta["/Title"], author=standard_meta["/Author"],
+        subject=standard_meta["/Subject"], keywords=standard_meta["/Keywords"],
+        creator=standard_meta["/Creator"], producer=standard_meta["/Producer"],
+    )
     styles = getSampleStyleSheet()
     story = []
 
@@ -103,57 +111,30 @@ def create_pdf_with_images(filename, title, paragraphs, images_spec):
 
     doc.build(story)
 
-
-def add_custom_metadata(input_path, output_path, standard_meta, custom_fields):
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    metadata = {**standard_meta, "/CustomFields": json.dumps(custom_fields)}
-    writer.add_metadata(metadata)
-    with open(output_path, "wb") as f:
-        writer.write(f)
-
-
-# ── Generate source images ──
-source_images = {
-    "chart_revenue": generate_sample_image(
-        os.path.join(IMAGES_DIR, "chart_revenue.png"), 640, 400, "#2563eb", "Revenue Chart", "rect"
-    ),
-    "chart_expenses": generate_sample_image(
-        os.path.join(IMAGES_DIR, "chart_expenses.png"), 640, 400, "#dc2626", "Expenses Chart", "rect"
-    ),
-    "logo_company": generate_sample_image(
-        os.path.join(IMAGES_DIR, "logo_company.png"), 200, 200, "#059669", "ACME", "circle"
-    ),
-    "diagram_arch": generate_sample_image(
-        os.path.join(IMAGES_DIR, "diagram_arch.png"), 800, 500, "#7c3aed", "System Architecture", "rect"
-    ),
-    "photo_team": generate_sample_image(
-        os.path.join(IMAGES_DIR, "photo_team.png"), 640, 480, "#ea580c", "Team Photo", "rect"
-    ),
-    "icon_badge": generate_sample_image(
-        os.path.join(IMAGES_DIR, "icon_badge.png"), 128, 128, "#0891b2", "Badge", "diamond"
-    ),
-    "diagram_flow": generate_sample_image(
-        os.path.join(IMAGES_DIR, "diagram_flow.png"), 700, 400, "#4f46e5", "Process Flow", "rect"
-    ),
-    "chart_ml": generate_sample_image(
-        os.path.join(IMAGES_DIR, "chart_ml.png"), 600, 400, "#0d9488", "ML Accuracy", "rect"
-    ),
-    "diagram_neural": generate_sample_image(
-        os.path.join(IMAGES_DIR, "diagram_neural.png"), 500, 500, "#8b5cf6", "Neural Network", "circle"
-    ),
-    "chart_energy": generate_sample_image(
-        os.path.join(IMAGES_DIR, "chart_energy.png"), 640, 350, "#16a34a", "Energy Usage", "rect"
-    ),
-    "photo_office": generate_sample_image(
-        os.path.join(IMAGES_DIR, "photo_office.png"), 800, 450, "#f59e0b", "New Office", "rect"
-    ),
-    "roadmap_timeline": generate_sample_image(
-        os.path.join(IMAGES_DIR, "roadmap_timeline.png"), 900, 350, "#6366f1", "2025 Roadmap", "rect"
-    ),
+    # ReportLab only writes the standard Info keys; /CustomFields is added by
+    # pypdf, straight from the in-memory build (no temp file)
+    buf.seek(0)
+    writer = PdfWriter(clone_from=PdfReader(buf))
+    writer.add_metadata({"/CustomFields": json.dumps(custom_fields)})
+    writer.write(filename)
+
+
+# ── Source images (generated in __main__ before the PDFs are built) ──
+SOURCE_IMAGE_SPECS = {
+    "chart_revenue": (640, 400, "#2563eb", "Revenue Chart", "rect"),
+    "chart_expenses": (640, 400, "#dc2626", "Expenses Chart", "rect"),
+    "logo_company": (200, 200, "#059669", "ACME", "circle"),
+    "diagram_arch": (800, 500, "#7c3aed", "System Architecture", "rect"),
+    "photo_team": (640, 480, "#ea580c", "Team Photo", "rect"),
+    "icon_badge": (128, 128, "#0891b2", "Badge", "diamond"),
+    "diagram_flow": (700, 400, "#4f46e5", "Process Flow", "rect"),
+    "chart_ml": (600, 400, "#0d9488", "ML Accuracy", "rect"),
+    "diagram_neural": (500, 500, "#8b5cf6", "Neural Network", "circle"),
+    "chart_energy": (640, 350, "#16a34a", "Energy Usage", "rect"),
+    "photo_office": (800, 450, "#f59e0b", "New Office", "rect"),
+    "roadmap_timeline": (900, 350, "#6366f1", "2025 Roadmap", "rect"),
 }
+source_images = {name: os.path.join(IMAGES_DIR, f"{name}.png") for name in SOURCE_IMAGE_SPECS}
 
 # ── PDF definitions ──
 samples = [
@@ -306,22 +287,31 @@ samples = [
 ]
 
 
+def _build_one(sample):
+    """Build one sample PDF and return its progress lines."""
+    final_path = os.path.join(OUTPUT_DIR, sample['filename'])
+
+    create_pdf_with_images(final_path, sample["title"], sample["content"], sample["images"],
+                           sample["standard"], sample["custom"])
+
+    img_count = len(sample["images"])
+    return (
+        f"  Created: {sample['filename']}\n"
+        f"    Classification : {sample['custom']['classification']}\n"
+        f"    Embedded images: {img_count}\n"
+    )
+
+
 if __name__ == "__main__":
     print("Creating sample PDFs with images + JSON custom metadata...\n")
 
-    for sample in samples:
-        temp_path = os.path.join(OUTPUT_DIR, f"temp_{sample['filename']}")
-        final_path = os.path.join(OUTPUT_DIR, sample['filename'])
-
-        create_pdf_with_images(temp_path, sample["title"], sample["content"], sample["images"])
-        add_custom_metadata(temp_path, final_path, sample["standard"], sample["custom"])
-        os.remove(temp_path)
+    for name, spec in SOURCE_IMAGE_SPECS.items():
+        generate_sample_image(source_images[name], *spec)
 
-        img_count = len(sample["images"])
-        print(f"  Created: {sample['filename']}")
-        print(f"    Classification : {sample['custom']['classification']}")
-        print(f"    Embedded images: {img_count}")
-        print()
+    # ReportLab is pure Python, so each PDF gets its own process
+    with ProcessPoolExecutor(max_workers=min(len(samples), os.cpu_count() or 1)) as ex:
+        for status in ex.map(_build_one, samples):
+            print(status)
 
     print(f"All PDFs saved to: {OUTPUT_DIR}")
 
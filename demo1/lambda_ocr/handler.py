@@ -1,30 +1,24 @@
-"""Lambda function: OCR text extraction from a base64-encoded image using Tesseract."""
+"""Lambda function: OCR text extraction from base64-encoded images using Tesseract."""
 
-import base64
 import json
 import subprocess
 import tempfile
 import time
 import os
 
+try:
+    import pybase64 as base64  # SIMD base64, drop-in for the stdlib API
+except ImportError:
+    import base64
 
-def handler(event, context):
-    """Receive base64 image, run Tesseract, return extracted text + timing."""
-    start = time.time()
+# Keep tesseract's OpenMP to one thread; throughput comes from running
+# pages/images side by side instead of threads contending on one page.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
 
-    body = event
-    if isinstance(event.get("body"), str):
-        body = json.loads(event["body"])
 
-    image_b64 = body.get("image_b64", "")
-    image_ext = body.get("image_ext", "png")
-    image_name = body.get("image_name", "unknown")
-
-    if not image_b64:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({"error": "No image_b64 provided"}),
-        }
+def ocr_image(image_b64, image_ext, image_name):
+    """Run Tesseract on one base64 image and return its result dict."""
+    start = time.time()
 
     try:
         img_bytes = base64.b64decode(image_b64)
@@ -35,7 +29,7 @@ def handler(event, context):
 
         out_base = tmp_path + "_out"
         result = subprocess.run(
-            ["tesseract", tmp_path, out_base, "-l", "eng", "--psm", "6"],
+            ["tesseract", tmp_path, out_base, "-l", "eng", "--oem", "1", "--psm", "6"],
             capture_output=True,
             text=True,
             timeout=30,
@@ -53,22 +47,59 @@ def handler(event, context):
         elapsed_ms = round((time.time() - start) * 1000, 2)
 
         return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "image_name": image_name,
-                "text": text,
-                "elapsed_ms": elapsed_ms,
-                "tesseract_stderr": result.stderr.strip() if result.stderr else "",
-            }),
+            "image_name": image_name,
+            "text": text,
+            "elapsed_ms": elapsed_ms,
+            "tesseract_stderr": result.stderr.strip() if result.stderr else "",
         }
 
     except Exception as e:
         elapsed_ms = round((time.time() - start) * 1000, 2)
         return {
-            "statusCode": 500,
+            "error": str(e),
+            "image_name": image_name,
+            "elapsed_ms": elapsed_ms,
+        }
+
+
+def handler(event, context):
+    """Receive one base64 image (or an ``images`` batch), run Tesseract, return text + timing."""
+    start = time.time()
+
+    body = event
+    if isinstance(event.get("body"), str):
+        body = json.loads(event["body"])
+
+    # Batch mode: {"images": [{"image_b64", "image_ext", "image_name"}, ...]}
+    if "images" in body:
+        results = [
+            ocr_image(
+                item.get("image_b64", ""),
+                item.get("image_ext", "png"),
+                item.get("image_name", "unknown"),
+            )
+            for item in body["images"]
+        ]
+        return {
+            "statusCode": 200,
             "body": json.dumps({
-                "error": str(e),
-                "image_name": image_name,
-                "elapsed_ms": elapsed_ms,
+                "results": results,
+                "elapsed_ms": round((time.time() - start) * 1000, 2),
             }),
         }
+
+    image_b64 = body.get("image_b64", "")
+    image_ext = body.get("image_ext", "png")
+    image_name = body.get("image_name", "unknown")
+
+    if not image_b64:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "No image_b64 provided"}),
+        }
+
+    result = ocr_image(image_b64, image_ext, image_name)
+    return {
+        "statusCode": 500 if "error" in result else 200,
+        "body": json.dumps(result),
+    }
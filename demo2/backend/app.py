@@ -1,14 +1,21 @@
 import os
-import json
 import time
-import base64
 import logging
+import threading
+import uuid
 
 import boto3
+import orjson
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
+try:
+    import pybase64 as base64  # SIMD base64, drop-in for the stdlib API
+except ImportError:
+    import base64
+
 app = Flask(__name__)
 CORS(app)
 logging.basicConfig(level=logging.INFO)
@@ -19,21 +26,44 @@ FUNC_NAME = os.environ.get("LAMBDA_FUNCTION_NAME", "ocr-extract")
 REGION = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
 ALLOWED = set(["pdf", "tiff", "tif", "png", "jpg", "jpeg"])
 MAX_SIZE = 20 * 1024 * 1024
-
-
-def get_client():
-    return boto3.client(
-        "lambda",
-        endpoint_url=ENDPOINT,
-        region_name=REGION,
-        aws_access_key_id="test",
-        aws_secret_access_key="test",
-    )
+# Uploads above this go to S3 and the Lambda gets a reference instead of base64
+S3_BUCKET = os.environ.get("S3_BUCKET", "ocr-in")
+S3_THRESHOLD = int(os.environ.get("S3_THRESHOLD", str(1024 * 1024)))
+# Multiple of 3 so each chunk base64-encodes without padding.
+B64_CHUNK = 57 * 1024
+# Room for multipart boundaries/headers on top of MAX_SIZE
+MULTIPART_SLACK = 64 * 1024
+LAMBDA_STATE_ERRORS = ("ResourceNotFoundException", "ResourceConflictException")
+
+
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def get_client(service="lambda"):
+    # boto3 clients are thread-safe for calls; build one per service per process.
+    client = _clients.get(service)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(service)
+            if client is None:
+                client = _clients[service] = boto3.client(
+                    service,
+                    endpoint_url=ENDPOINT,
+                    region_name=REGION,
+                    aws_access_key_id="test",
+                    aws_secret_access_key="test",
+                    # Enough pooled connections for every gthread worker thread
+                    config=BotoConfig(max_pool_connections=64),
+                )
+    return client
 
 
 def wait_for_active(timeout=180):
     c = get_client()
     deadline = time.time() + timeout
+    # Back off from 0.1 s to 2 s so a quick LocalStack boot is noticed at once
+    delay = 0.1
     while time.time() < deadline:
         try:
             resp = c.get_function(FunctionName=FUNC_NAME)
@@ -52,7 +82,8 @@ def wait_for_active(timeout=180):
                 log.warning("ClientError: %s", str(e))
         except Exception as e:
             log.warning("Connection error: %s", str(e))
-        time.sleep(5)
+        time.sleep(min(delay, max(0, deadline - time.time())))
+        delay = min(delay * 1.6, 2.0)
     return False
 
 
@@ -66,6 +97,10 @@ with app.app_context():
 
 @app.route("/api/extract", methods=["POST"])
 def extract_text():
+    # Refuse oversized bodies before werkzeug spools the multipart upload
+    if (request.content_length or 0) > MAX_SIZE + MULTIPART_SLACK:
+        return jsonify({"error": "File exceeds 20 MB"}), 413
+
     if "file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
 
@@ -80,38 +115,65 @@ def extract_text():
     if ext not in ALLOWED:
         return jsonify({"error": "Unsupported file type"}), 400
 
-    data = f.read()
-    if len(data) > MAX_SIZE:
-        return jsonify({"error": "File exceeds 20 MB"}), 413
-
-    payload = json.dumps({
-        "file_data": base64.b64encode(data).decode("ascii"),
-        "file_name": f.filename,
-        "file_type": ext,
-    })
-
-    log.info("Invoking Lambda for %s (%d bytes)", f.filename, len(data))
+    # Read chunk by chunk, rejecting as soon as the limit is crossed. Uploads
+    # that stay inline are base64-encoded as they arrive; once past
+    # S3_THRESHOLD only the raw bytes (for S3) are kept.
+    size = 0
+    data = bytearray()
+    b64_buf = bytearray()
+    while True:
+        chunk = f.stream.read(B64_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_SIZE:
+            return jsonify({"error": "File exceeds 20 MB"}), 413
+        data += chunk
+        if size <= S3_THRESHOLD:
+            b64_buf += base64.b64encode(chunk)
+        elif b64_buf:
+            b64_buf = bytearray()
+
+    s3_key = None
     t0 = time.perf_counter()
 
     try:
+        if size > S3_THRESHOLD:
+            # Large files skip the base64 round trip and the inflated JSON
+            # payload: hand the Lambda an S3 reference instead.
+            s3_key = uuid.uuid4().hex
+            get_client("s3").put_object(Bucket=S3_BUCKET, Key=s3_key, Body=bytes(data))
+            payload = orjson.dumps({
+                "s3_bucket": S3_BUCKET,
+                "s3_key": s3_key,
+                "file_name": f.filename,
+                "file_type": ext,
+            })
+        else:
+            # orjson can't serialise bytes; splice the base64 text in directly
+            payload = b"".join([
+                b'{"file_data": "', b64_buf,
+                b'", "file_name": ', orjson.dumps(f.filename),
+                b', "file_type": ', orjson.dumps(ext), b"}",
+            ])
+        del data, b64_buf
+
+        log.info("Invoking Lambda for %s (%d bytes, %s)", f.filename, size,
+                 "s3" if s3_key else "inline")
         c = get_client()
-
         try:
-            info = c.get_function(FunctionName=FUNC_NAME)
-            state = info.get("Configuration", {}).get("State", "Unknown")
-            if state != "Active":
-                return jsonify({"error": "Lambda not ready, state=" + state}), 503
+            resp = c.invoke(
+                FunctionName=FUNC_NAME,
+                InvocationType="RequestResponse",
+                Payload=payload,
+            )
         except ClientError as e:
-            code = e.response["Error"]["Code"]
-            if code == "ResourceNotFoundException":
-                return jsonify({"error": "Lambda function not found"}), 503
+            # No get_function probe up front: invoke itself says when the
+            # function is missing or not Active.
+            if e.response["Error"]["Code"] in LAMBDA_STATE_ERRORS:
+                log.warning("Lambda not ready: %s", str(e))
+                return jsonify({"error": "Lambda not ready"}), 503
             raise
-
-        resp = c.invoke(
-            FunctionName=FUNC_NAME,
-            InvocationType="RequestResponse",
-            Payload=payload,
-        )
         raw = resp["Payload"].read().decode("utf-8")
         elapsed = int((time.perf_counter() - t0) * 1000)
 
@@ -119,11 +181,11 @@ def extract_text():
             log.error("FunctionError: %s", raw[:500])
             return jsonify({"error": "Lambda error: " + raw[:300]}), 502
 
-        result = json.loads(raw)
+        result = orjson.loads(raw)
 
         body = result
         if "body" in result and isinstance(result["body"], str):
-            body = json.loads(result["body"])
+            body = orjson.loads(result["body"])
         elif "body" in result:
             body = result["body"]
 
@@ -143,6 +205,12 @@ def extract_text():
     except Exception as e:
         log.exception("Unexpected error")
         return jsonify({"error": str(e)}), 502
+    finally:
+        if s3_key:
+            try:
+                get_client("s3").delete_object(Bucket=S3_BUCKET, Key=s3_key)
+            except Exception:
+                log.warning("Could not delete s3://%s/%s", S3_BUCKET, s3_key)
 
 
 @app.route("/api/health", methods=["GET"])
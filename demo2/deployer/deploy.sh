@@ -5,6 +5,7 @@ FUNCTION_NAME="ocr-extract"
 LAYER_ZIP="/layers/layer.zip"
 ENDPOINT="http://localstack:4566"
 REGION="us-east-1"
+BUCKET="ocr-in"
 ROLE_ARN="arn:aws:iam::000000000000:role/lambda-ocr-role"
 RUNTIME="python3.9"
 
@@ -46,8 +47,9 @@ echo "  Unpacked layer: $(ls)"
 # Make binaries executable
 chmod +x "$BUILD_DIR/bin/"* 2>/dev/null || true
 
-# Install PyPDF2 (pure Python, only pip dependency)
-pip3 install --no-cache-dir --target "$BUILD_DIR" 'PyPDF2==3.0.1'
+# Install pypdfium2 (text extraction + in-process rasterization), PyPDF2
+# (pure-Python fallback if pdfium's wheel won't load), pybase64 and orjson
+pip3 install --no-cache-dir --target "$BUILD_DIR" 'pypdfium2==4.30.0' 'PyPDF2==3.0.1' 'pybase64==1.4.0' 'orjson==3.10.7'
 
 # Copy handler
 cp /src/handler.py "$BUILD_DIR/"
@@ -57,7 +59,7 @@ cd "$BUILD_DIR"
 zip -r9 /tmp/function.zip . > /dev/null 2>&1
 ZIP_SIZE=$(du -sh /tmp/function.zip | cut -f1)
 echo "  Combined zip: $ZIP_SIZE"
-echo "  Contents: handler.py + PyPDF2 + bin/ + lib/ + share/"
+echo "  Contents: handler.py + pypdfium2 + PyPDF2 + bin/ + lib/ + share/"
 
 echo "[3/6] Waiting for Lambda service..."
 TRIES=0
@@ -76,11 +78,13 @@ while true; do
     sleep 2
 done
 
-echo "[4/6] Creating IAM role..."
+echo "[4/6] Creating IAM role and upload bucket..."
 awsl iam create-role \
     --role-name lambda-ocr-role \
     --assume-role-policy-document '{"Version":"2012-10-17","Statement":[{"Effect":"Allow","Principal":{"Service":"lambda.amazonaws.com"},"Action":"sts:AssumeRole"}]}' \
     > /dev/null 2>&1 || echo "  (exists)"
+# Backend puts uploads over 1 MB here and passes the Lambda a key
+awsl s3 mb "s3://$BUCKET" > /dev/null 2>&1 || echo "  (bucket exists)"
 
 echo "[5/6] Creating function (no layers - binaries bundled in zip)..."
 awsl lambda delete-function --function-name "$FUNCTION_NAME" 2>/dev/null || true
@@ -1,12 +1,33 @@
 import os
 import json
 import time
-import base64
 import io
 import logging
 import subprocess
 import tempfile
 import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+try:
+    import pybase64 as base64  # SIMD base64, drop-in for the stdlib API
+except ImportError:
+    import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # fall back to PyPDF2 text + bundled pdftoppm
+    pdfium = None
+    try:
+        import PyPDF2
+    except ImportError:  # no text layer reader at all: OCR every PDF
+        PyPDF2 = None
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -20,9 +41,46 @@ PDFTOPPM = os.path.join(TASK_DIR, "bin", "pdftoppm")
 LIB_DIR = os.path.join(TASK_DIR, "lib")
 TESSDATA_DIR = os.path.join(TASK_DIR, "share", "tessdata")
 
-# Set up environment so shared libraries and tessdata are found
+# 200-300 DPI is the sweet spot for printed text; tesseract time scales with pixels
+OCR_DPI = int(os.environ.get("OCR_DPI", "225"))
+# A PDF whose first pages carry no embedded text is treated as a scan
+NATIVE_PROBE_PAGES = 5
+
+# Set up environment so shared libraries and tessdata are found; child
+# processes inherit os.environ, so no per-call env copy is needed.
 os.environ["LD_LIBRARY_PATH"] = LIB_DIR + ":" + os.environ.get("LD_LIBRARY_PATH", "")
 os.environ["TESSDATA_PREFIX"] = TESSDATA_DIR
+# Keep tesseract's OpenMP to one thread; throughput comes from running
+# pages/images side by side instead of threads contending on one page.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# LocalStack points the Lambda at itself via AWS_ENDPOINT_URL (newer) or
+# LOCALSTACK_HOSTNAME (older); on real AWS both are unset.
+if os.environ.get("AWS_ENDPOINT_URL"):
+    S3_ENDPOINT = os.environ["AWS_ENDPOINT_URL"]
+elif os.environ.get("LOCALSTACK_HOSTNAME"):
+    S3_ENDPOINT = "http://%s:%s" % (os.environ["LOCALSTACK_HOSTNAME"],
+                                    os.environ.get("EDGE_PORT", "4566"))
+else:
+    S3_ENDPOINT = None
+
+_s3 = None
+
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client("s3", endpoint_url=S3_ENDPOINT)
+    return _s3
+
+# One scratch dir per warm container. Lambda runs a single request at a
+# time per container, and we only ever write flat files into it.
+SCRATCH = tempfile.mkdtemp(prefix="ocr-")
+
+
+def clear_scratch():
+    for name in os.listdir(SCRATCH):
+        os.unlink(os.path.join(SCRATCH, name))
 
 
 def _cold_start_check():
@@ -50,7 +108,11 @@ _cold_start_check()
 def handler(event, context):
     t0 = time.perf_counter()
     try:
-        file_data = base64.b64decode(event["file_data"])
+        if event.get("s3_bucket"):
+            obj = get_s3().get_object(Bucket=event["s3_bucket"], Key=event["s3_key"])
+            file_data = obj["Body"].read()
+        else:
+            file_data = base64.b64decode(event["file_data"])
         file_type = event.get("file_type", "pdf").lower()
         file_name = event.get("file_name", "upload")
         logger.info("Processing %s (%s, %d bytes)", file_name, file_type, len(file_data))
@@ -74,75 +136,169 @@ def handler(event, context):
 
 def extract_pdf(data):
     try:
-        import PyPDF2
-        reader = PyPDF2.PdfReader(io.BytesIO(data))
-        pages = len(reader.pages)
-        parts = []
-        for p in reader.pages:
-            t = p.extract_text()
-            if t:
-                parts.append(t)
-        combined = "\n\n".join(parts)
-        if len(combined.strip()) > 20:
-            return combined, pages
+        pages, text = native_text(data)
+        if text is not None:
+            return text, pages
     except Exception as e:
-        logger.warning("PyPDF2 failed: %s", str(e))
+        logger.warning("Native text extraction failed: %s", str(e))
         pages = 0
 
     logger.info("Native text empty or failed, using OCR")
-    text = ocr_pdf_bytes(data)
+    text = ocr_pdf_bytes(data, pages)
     if pages == 0:
         pages = 1
     return text, pages
 
 
-def ocr_pdf_bytes(data):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        pdf_path = os.path.join(tmpdir, "input.pdf")
-        with open(pdf_path, "wb") as f:
-            f.write(data)
+def native_text(data):
+    """Return (page count, embedded text or None) via pdfium, else PyPDF2."""
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(data)
+        try:
+            return len(pdf), collect_text(
+                p.get_textpage().get_text_range().replace("\r\n", "\n") for p in pdf)
+        finally:
+            pdf.close()
+
+    if PyPDF2 is None:  # unknown page count, no text: pdftoppm lists the pages
+        return 0, None
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return len(reader.pages), collect_text(p.extract_text() or "" for p in reader.pages)
+
 
-        img_prefix = os.path.join(tmpdir, "page")
-        env = os.environ.copy()
-        cmd = [PDFTOPPM, "-r", "300", "-png", pdf_path, img_prefix]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120, env=env)
-        if result.returncode != 0:
-            raise RuntimeError("pdftoppm failed: " + result.stderr[:300])
+def collect_text(page_texts):
+    """Join page texts, or None once the first pages show it's a scan."""
+    parts = []
+    chars = 0
+    for text in page_texts:
+        parts.append(text)
+        chars += len(text.strip())
+        if len(parts) >= NATIVE_PROBE_PAGES and chars <= 20:
+            return None
+    combined = "\n\n".join(t for t in parts if t)
+    if len(combined.strip()) > 20:
+        return combined
+    return None
 
-        pngs = sorted(glob.glob(img_prefix + "*.png"))
-        if not pngs:
-            raise RuntimeError("pdftoppm produced no images")
+
+def ocr_pdf_bytes(data, pages=0):
+    try:
+        if pdfium is not None:
+            images = render_pages(data, SCRATCH)
+        else:
+            images = pdftoppm_pages(data, SCRATCH, pages)
+        if not images:
+            raise RuntimeError("PDF rendered no pages")
+
+        # Split the pages into one contiguous batch per core; each batch is a
+        # single tesseract process (one model load). Threads are enough here
+        # since each one just waits on its child process.
+        workers = min(len(images), os.cpu_count() or 1)
+        size = -(-len(images) // workers)
+        batches = [images[i:i + size] for i in range(0, len(images), size)]
+        logger.info("OCR %d pages in %d batches", len(images), len(batches))
+        with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+            texts = [t for batch in pool.map(run_tesseract_batch, batches) for t in batch]
 
         parts = []
-        for i, png in enumerate(pngs):
-            logger.info("OCR page %d/%d", i + 1, len(pngs))
-            text = run_tesseract(png)
+        for i, text in enumerate(texts):
             parts.append("--- Page " + str(i + 1) + " ---\n" + text)
         return "\n\n".join(parts)
+    finally:
+        clear_scratch()
+
+
+def render_pages(data, tmpdir):
+    """Rasterize in-process with pdfium into uncompressed 8-bit grey PGM files."""
+    pdf = pdfium.PdfDocument(data)
+    try:
+        paths = []
+        for i, page in enumerate(pdf):
+            bitmap = page.render(scale=OCR_DPI / 72, grayscale=True)
+            path = os.path.join(tmpdir, "page-" + str(i + 1) + ".pnm")
+            write_pnm(path, bitmap)
+            paths.append(path)
+        return paths
+    finally:
+        pdf.close()
+
+
+def write_pnm(path, bitmap):
+    magic = b"P5" if bitmap.n_channels == 1 else b"P6"
+    row = bitmap.width * bitmap.n_channels
+    buf = memoryview(bitmap.buffer).cast("B")
+    with open(path, "wb") as f:
+        f.write(b"%s\n%d %d\n255\n" % (magic, bitmap.width, bitmap.height))
+        if bitmap.stride == row:
+            f.write(buf)
+        else:
+            for y in range(bitmap.height):
+                start = y * bitmap.stride
+                f.write(buf[start:start + row])
+
+
+def pdftoppm_pages(data, tmpdir, pages=0):
+    pdf_path = os.path.join(tmpdir, "input.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(data)
+
+    img_prefix = os.path.join(tmpdir, "page")
+    cmd = [PDFTOPPM, "-r", str(OCR_DPI), "-gray", "-png"]
+    if pages:
+        cmd += ["-f", "1", "-l", str(pages)]
+    cmd += [pdf_path, img_prefix]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError("pdftoppm failed: " + result.stderr[:300])
+
+    # pdftoppm writes <prefix>-N.png with N zero-padded to a width of its own
+    # choosing, so list what it wrote; same-width names sort in page order.
+    return sorted(glob.glob(img_prefix + "-*.png"))
 
 
 def ocr_image_bytes(data, ext):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        img_path = os.path.join(tmpdir, "input." + ext)
+    try:
+        img_path = os.path.join(SCRATCH, "input." + ext)
         with open(img_path, "wb") as f:
             f.write(data)
         return run_tesseract(img_path)
+    finally:
+        clear_scratch()
+
+
+def run_tesseract_batch(image_paths):
+    """OCR several images with one tesseract run via a list file; one text per image."""
+    if len(image_paths) == 1:
+        return [run_tesseract(image_paths[0])]
+
+    list_path = os.path.splitext(image_paths[0])[0] + "-list.txt"
+    with open(list_path, "w") as f:
+        f.write("\n".join(image_paths) + "\n")
+
+    # tesseract ends every page with a form feed
+    texts = run_tesseract(list_path, timeout=60 * len(image_paths)).split("\f")
+    if len(texts) < len(image_paths):
+        raise RuntimeError("tesseract returned %d pages for %d images"
+                           % (len(texts), len(image_paths)))
+    return texts[:len(image_paths)]
 
 
-def run_tesseract(image_path):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        out_base = os.path.join(tmpdir, "out")
-        env = os.environ.copy()
-        cmd = [TESSERACT, image_path, out_base, "-l", "eng"]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60, env=env)
-        if result.returncode != 0:
-            raise RuntimeError("tesseract failed: " + result.stderr[:300])
-        out_file = out_base + ".txt"
-        if os.path.exists(out_file):
-            with open(out_file, "r") as f:
-                return f.read()
-        return ""
+def run_tesseract(image_path, timeout=60):
+    # Writes <image>-out.txt beside its input, so it's cleared with SCRATCH
+    out_base = os.path.splitext(image_path)[0] + "-out"
+    # LSTM only, one uniform block: skips the page layout analysis pass
+    cmd = [TESSERACT, image_path, out_base, "-l", "eng", "--oem", "1", "--psm", "6"]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError("tesseract failed: " + result.stderr[:300])
+    out_file = out_base + ".txt"
+    if os.path.exists(out_file):
+        with open(out_file, "r") as f:
+            return f.read()
+    return ""
 
 
 def make_response(code, **body):
+    if orjson is not None:
+        return {"statusCode": code, "body": orjson.dumps(body).decode()}
     return {"statusCode": code, "body": json.dumps(body)}
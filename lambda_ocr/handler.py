@@ -1,12 +1,20 @@
 """Lambda function: OCR text extraction from a base64-encoded image using Tesseract."""
 
-import base64
 import json
 import subprocess
 import tempfile
 import time
 import os
 
+try:
+    import pybase64 as base64  # SIMD base64, drop-in for the stdlib API
+except ImportError:
+    import base64
+
+# Keep tesseract's OpenMP to one thread; throughput comes from running
+# pages/images side by side instead of threads contending on one page.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 
 def handler(event, context):
     """Receive base64 image, run Tesseract, return extracted text + timing."""
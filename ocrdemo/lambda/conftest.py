@@ -0,0 +1,66 @@
+"""Shared pytest setup for the Lambda handler tests."""
+
+import pathlib
+import sys
+from types import SimpleNamespace
+from unittest.mock import DEFAULT, patch
+
+import pytest
+
+# The handlers sit next to the tests; put this directory on sys.path once
+# for every test module instead of each one doing it at import.
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+
+
+class _FakeTmp:
+    """NamedTemporaryFile stand-in; nothing asserts on it, so no mock needed."""
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, data):
+        pass
+
+
+@pytest.fixture
+def fake_tmp(request, monkeypatch, tmp_path):
+    """Give the module's handler a temp file backed by a real empty file in tmp_path.
+
+    The handler module is named by the test module's HANDLER_MODULE. Returns
+    the list of NamedTemporaryFile kwargs the handler asked for. The file
+    really exists, so the handler's os.unlink needs no patching.
+    """
+    calls = []
+
+    def named_tmp(suffix="", delete=True):
+        calls.append({"suffix": suffix, "delete": delete})
+        path = tmp_path / ("upload" + suffix)
+        path.touch()
+        return _FakeTmp(str(path))
+
+    monkeypatch.setattr(request.module.HANDLER_MODULE + ".tempfile",
+                        SimpleNamespace(NamedTemporaryFile=named_tmp))
+    return calls
+
+
+@pytest.fixture(scope="module")
+def _handler_patches(request):
+    """Patch the module's HANDLER_PATCHES names in HANDLER_MODULE once per module."""
+    targets = dict.fromkeys(request.module.HANDLER_PATCHES, DEFAULT)
+    with patch.multiple(request.module.HANDLER_MODULE, **targets) as m:
+        yield m
+
+
+@pytest.fixture
+def mocks(_handler_patches):
+    """The module-wide patches, with calls, return values and side effects reset."""
+    for m in _handler_patches.values():
+        m.reset_mock(return_value=True, side_effect=True)
+    return _handler_patches
@@ -1,10 +1,31 @@
 import json
-import base64
 import time
 import subprocess
 import tempfile
 import os
 
+try:
+    import pybase64 as base64  # SIMD base64, drop-in for the stdlib API
+except ImportError:
+    import base64
+
+# Keep tesseract's OpenMP to one thread; throughput comes from running
+# pages/images side by side instead of threads contending on one page.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def _strip_data_url_prefix(data):
+    """Strip a data URL prefix if present (e.g. "data:image/png;base64,...")."""
+    # base64 never contains a comma, so everything up to the first one is header
+    if "," in data:
+        return data.split(",", 1)[1]
+    return data
+
+
+def _decode_payload(data):
+    """Decode a base64 image payload, data URL prefix and all; raises binascii.Error."""
+    return base64.b64decode(_strip_data_url_prefix(data))
+
 
 def lambda_handler(event, context):
     """OCR Lambda handler - extracts text from uploaded images."""
@@ -25,12 +46,7 @@ def lambda_handler(event, context):
         if not image_data:
             return {"error": "No image data provided"}
 
-        # Strip data URL prefix if present (e.g. "data:image/png;base64,...")
-        if "," in image_data:
-            image_data = image_data.split(",", 1)[1]
-
-        # Decode image bytes
-        image_bytes = base64.b64decode(image_data)
+        image_bytes = _decode_payload(image_data)
 
         # Write to temp file
         suffix = os.path.splitext(filename)[1] or ".png"
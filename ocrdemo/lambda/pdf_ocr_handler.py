@@ -2,48 +2,449 @@
 PDF OCR Handler — Extracts images from PDF pages, then runs Tesseract OCR on each.
 
 Flow:
-  PDF → PyMuPDF renders each page as image → Tesseract OCR per image → combined text
+  PDF → PyMuPDF renders each page as image → Tesseract OCR in batches of pages → combined text
+  (runs of pages are fanned out across CPU cores with a process pool, and
+  each worker renders the next pages while tesseract reads the current batch)
 
 Tracks timing at every stage:
   - Per page: image extraction time + OCR time
   - Total: overall pipeline time
 """
 
-import base64
+import binascii
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
+import queue
+import struct
 import subprocess
 import tempfile
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import fitz  # PyMuPDF
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def run_tesseract(image_path: str) -> tuple[str, float]:
-    """Run Tesseract OCR on an image file. Returns (text, elapsed_ms)."""
-    start = time.time()
+try:
+    from tesserocr import OEM, PSM, PyTessBaseAPI  # in-process libtesseract, no fork per batch
+except ImportError:
+    PyTessBaseAPI = None
+
+# Keep tesseract's OpenMP to one thread; throughput comes from running
+# pages/images side by side instead of threads contending on one page.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# Pages per tesseract run (one model load each); also bounds how many
+# rendered pages wait in memory for OCR.
+OCR_BATCH_PAGES = 4
+
+# Rendering above this buys no accuracy on ordinary text while OCR time
+# grows with the pixel count (600 DPI is 4x the pixels of 300)
+MAX_OCR_DPI = 400
+
+# A page is blank when no more than BLANK_MAX_INK of its pixels are darker
+# than BLANK_INK_LEVEL: that tolerates scanner specks (about 170 pixels on an
+# A4 page at 300 DPI) but keeps a page holding only a page number.
+BLANK_INK_LEVEL = 160
+BLANK_MAX_INK = 0.00002
+_LIGHT_PIXELS = bytes(range(BLANK_INK_LEVEL, 256))
+
+# Pages per process-pool task for multi-page documents (see chunk_size_for)
+PAGE_CHUNK_SIZE = 10
+
+# OCR results keyed by SHA-256 of the rendered page: an in-memory LRU per
+# process, backed by text files in /tmp that outlive it for the container.
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "/tmp/ocr_cache")
+OCR_CACHE_SIZE = 256
+# Text files kept on disk; a warm container's /tmp is only 512 MB by default
+OCR_CACHE_DISK_FILES = int(os.environ.get("OCR_CACHE_DISK_FILES", "4096"))
+
+_ocr_cache = OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
+# One process pool per server process, shared by every request thread. Its
+# workers come from a forkserver, so they never inherit a request thread's
+# locks, and they live on between requests with their loaded tesserocr
+# model and OCR cache.
+POOL_WORKERS = os.cpu_count() or 1
+_pool = None
+_pool_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+# Render matrices by DPI; nearly every request uses the same one or two
+_matrix_cache = {}
+
+# One tesserocr API (and one loaded model) per thread; instances are not thread-safe
+_tess_local = threading.local()
+
+
+def _tesseract_stdout(image_bytes, timeout: int = 60) -> str:
+    """Pipe one image (or multi-page TIFF) through tesseract and return its raw stdout."""
     result = subprocess.run(
-        ["tesseract", image_path, "stdout", "--oem", "1", "--psm", "3"],
+        ["tesseract", "stdin", "stdout", "--oem", "1", "--psm", "3"],
+        input=image_bytes,
         capture_output=True,
-        text=True,
-        timeout=60,
+        timeout=timeout,
     )
-    elapsed_ms = round((time.time() - start) * 1000, 2)
-    text = result.stdout.strip()
+    text = result.stdout.decode()
+
+    if result.returncode != 0 and not text.strip():
+        raise RuntimeError(f"Tesseract failed: {result.stderr.decode().strip()}")
+
+    return text
 
-    if result.returncode != 0 and not text:
-        raise RuntimeError(f"Tesseract failed: {result.stderr.strip()}")
 
+def run_tesseract(image_bytes: bytes) -> tuple[str, float]:
+    """Run Tesseract OCR on image bytes piped through stdin. Returns (text, elapsed_ms)."""
+    start = time.perf_counter_ns()
+    text = _tesseract_stdout(image_bytes).strip()
+    elapsed_ms = round((time.perf_counter_ns() - start) / 1e6, 2)
     return text, elapsed_ms
 
 
+def _pgm_raster(image: bytes) -> tuple[int, int, bytes]:
+    """Split an 8-bit grey PGM from extract_page_image into (width, height, raster)."""
+    _, size, _, raster = image.split(b"\n", 3)
+    width, height = map(int, size.split())
+    return width, height, raster
+
+
+def run_tesserocr(image: bytes) -> str:
+    """OCR a grey PGM page in-process, reusing this thread's loaded model."""
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = _tess_local.api = PyTessBaseAPI(lang="eng", psm=PSM.AUTO, oem=OEM.LSTM_ONLY)
+    width, height, raster = _pgm_raster(image)
+    api.SetImageBytes(raster, width, height, 1, width)
+    return api.GetUTF8Text().strip()
+
+
+def pgm_pages_to_tiff(images: list[bytes]) -> bytearray:
+    """
+    Pack 8-bit grey PGM pages (as rendered by extract_page_image) into one
+    uncompressed multi-page TIFF: one strip and one IFD per page.
+    """
+    out = bytearray(b"II*\x00\x00\x00\x00\x00")  # little-endian, first IFD offset patched below
+    link = 4  # where the offset of the next IFD gets written
+    for image in images:
+        width, height, raster = _pgm_raster(image)
+
+        strip = len(out)
+        out += raster
+        if len(out) % 2:  # IFDs must start on a word boundary
+            out += b"\x00"
+        struct.pack_into("<I", out, link, len(out))
+
+        # (tag, type, value); type 3 = SHORT, 4 = LONG
+        entries = (
+            (256, 4, width),        # ImageWidth
+            (257, 4, height),       # ImageLength
+            (258, 3, 8),            # BitsPerSample
+            (259, 3, 1),            # Compression: none
+            (262, 3, 1),            # PhotometricInterpretation: BlackIsZero
+            (273, 4, strip),        # StripOffsets
+            (277, 3, 1),            # SamplesPerPixel
+            (278, 4, height),       # RowsPerStrip
+            (279, 4, len(raster)),  # StripByteCounts
+        )
+        out += struct.pack("<H", len(entries))
+        for tag, kind, value in entries:
+            out += struct.pack("<HHII", tag, kind, 1, value)
+        link = len(out)
+        out += b"\x00\x00\x00\x00"  # next IFD: none, unless another page follows
+    return out
+
+
+def run_tesseract_batch(images: list[bytes]) -> tuple[list[str], float]:
+    """
+    OCR several page images with a single tesseract run, so the trained
+    model is loaded once for the batch rather than once per page. With
+    tesserocr installed the model stays loaded in-process instead and no
+    tesseract process is started at all. Returns (texts, elapsed_ms) with
+    one text per image.
+    """
+    if PyTessBaseAPI is not None:
+        start = time.perf_counter_ns()
+        texts = [run_tesserocr(image) for image in images]
+        return texts, round((time.perf_counter_ns() - start) / 1e6, 2)
+
+    if len(images) == 1:
+        text, elapsed_ms = run_tesseract(images[0])
+        return [text], elapsed_ms
+
+    start = time.perf_counter_ns()
+    # tesseract walks the TIFF's pages and ends each one with a form feed
+    texts = _tesseract_stdout(pgm_pages_to_tiff(images), timeout=60 * len(images)).split("\f")
+    elapsed_ms = round((time.perf_counter_ns() - start) / 1e6, 2)
+    if len(texts) < len(images):
+        raise RuntimeError(f"Tesseract returned {len(texts)} pages for {len(images)} images")
+    return [t.strip() for t in texts[:len(images)]], elapsed_ms
+
+
+def _prune_disk_cache():
+    """Drop the least recently used cache files once there are too many."""
+    entries = []
+    with os.scandir(OCR_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(".txt"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:  # pruned by another worker
+                    pass
+    if len(entries) <= OCR_CACHE_DISK_FILES:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - OCR_CACHE_DISK_FILES]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def cached_ocr(images: list[bytes]) -> list[tuple[str, float, bool]]:
+    """
+    OCR a batch of page images through the cache; all the misses go to
+    tesseract together. Returns (text, elapsed_ms, cache_hit) per image, with
+    the batch's tesseract time shared evenly across the pages it OCR'd.
+    """
+    if not images:
+        return []
+    start = time.perf_counter_ns()
+    keys = [hashlib.sha256(image).hexdigest() for image in images]
+
+    texts = {}
+    with _ocr_cache_lock:
+        for key in keys:
+            if key in _ocr_cache:
+                _ocr_cache.move_to_end(key)
+                texts[key] = _ocr_cache[key]
+
+    misses = {}
+    for key, image in zip(keys, images):
+        if key in texts or key in misses:
+            continue
+        path = os.path.join(OCR_CACHE_DIR, key + ".txt")
+        try:
+            with open(path, encoding="utf-8") as f:
+                texts[key] = f.read()
+            os.utime(path)  # mtime is the recency _prune_disk_cache evicts by
+        except FileNotFoundError:
+            misses[key] = image
+    lookup_ms = (time.perf_counter_ns() - start) / 1e6 / len(images)
+
+    ocr_ms = 0
+    if misses:
+        batch_texts, batch_ms = run_tesseract_batch(list(misses.values()))
+        ocr_ms = batch_ms / len(misses)
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        for key, text in zip(misses, batch_texts):
+            texts[key] = text
+            # Write then rename so a concurrent reader never sees half a file
+            path = os.path.join(OCR_CACHE_DIR, key + ".txt")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        _prune_disk_cache()
+
+    with _ocr_cache_lock:
+        for key in keys:
+            _ocr_cache[key] = texts[key]
+            _ocr_cache.move_to_end(key)
+        while len(_ocr_cache) > OCR_CACHE_SIZE:
+            _ocr_cache.popitem(last=False)
+
+    return [
+        (texts[key], round(lookup_ms + (ocr_ms if key in misses else 0), 2), key not in misses)
+        for key in keys
+    ]
+
+
 def extract_page_image(page, dpi: int = 300) -> tuple[bytes, float]:
-    """Render a PDF page to a PNG image. Returns (png_bytes, elapsed_ms)."""
-    start = time.time()
-    mat = fitz.Matrix(dpi / 72, dpi / 72)
-    pix = page.get_pixmap(matrix=mat)
-    png_bytes = pix.tobytes("png")
-    elapsed_ms = round((time.time() - start) * 1000, 2)
-    return png_bytes, elapsed_ms
+    """
+    Render a PDF page to an 8-bit grey PGM image. Returns (image_bytes, elapsed_ms).
+
+    PGM is uncompressed, so this skips the zlib deflate (and tesseract's
+    inflate) a PNG costs per page, at the price of holding the raw raster:
+    ~8.7 MB for an A4 page at 300 DPI vs roughly 1 MB as PNG. That is fine
+    since pages go to tesseract over a pipe and the render queue is bounded.
+    Rendering grey rather than RGB keeps it a third of the size of PPM;
+    tesseract binarises the page anyway.
+    """
+    start = time.perf_counter_ns()
+    mat = _matrix_cache.get(dpi)
+    if mat is None:
+        mat = _matrix_cache[dpi] = fitz.Matrix(dpi / 72, dpi / 72)
+    pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY)
+    image_bytes = pix.tobytes("pgm")
+    elapsed_ms = round((time.perf_counter_ns() - start) / 1e6, 2)
+    return image_bytes, elapsed_ms
+
+
+def is_blank_page(image: bytes) -> bool:
+    """
+    True when a grey PGM page from extract_page_image has next to no ink:
+    at most BLANK_MAX_INK of its pixels are darker than BLANK_INK_LEVEL.
+    """
+    _, size, _, _ = image[:32].split(b"\n", 3)
+    width, height = map(int, size.split())
+    pixels = width * height
+    # translate() drops every light pixel in one C pass (~4 ms for an A4 page
+    # at 300 DPI). What's left is the ink plus the header, whose bytes are all
+    # ASCII and so below BLANK_INK_LEVEL.
+    ink = len(image.translate(None, _LIGHT_PIXELS)) - (len(image) - pixels)
+    return ink <= pixels * BLANK_MAX_INK
+
+
+def ocr_images(batch: list[tuple]) -> list[tuple]:
+    """
+    OCR a batch of rendered pages, each (index, image_bytes, extract_ms).
+    Returns (index, text, image_size_bytes, extract_ms, ocr_ms, page_total_ms, cache_hit, skipped_blank)
+    per page.
+    """
+    # Blank pages (separator sheets) get empty text without a cache lookup or tesseract
+    blank = [is_blank_page(image_bytes) for _, image_bytes, _ in batch]
+    ocr = iter(cached_ocr([page[1] for page, skip in zip(batch, blank) if not skip]))
+
+    results = []
+    for (index, image_bytes, extract_ms), skip in zip(batch, blank):
+        text, ocr_ms, cache_hit = ("", 0.0, False) if skip else next(ocr)
+        page_total_ms = round(extract_ms + ocr_ms, 2)
+        results.append((index, text, len(image_bytes), extract_ms, ocr_ms, page_total_ms, cache_hit, skip))
+    return results
+
+
+def _run_pipeline(doc, indices, dpi: int) -> list[tuple]:
+    """
+    Render pages on a producer thread while this thread OCRs the previous
+    ones. Tesseract is a child process, so waiting on it leaves the GIL free
+    for rendering and wall time approaches max(render, ocr) per page instead
+    of their sum. The bounded queue caps how many rendered images are held.
+    """
+    rendered = queue.Queue(maxsize=OCR_BATCH_PAGES)
+    stop = threading.Event()
+    failure = []
+
+    def render():
+        try:
+            for i in indices:
+                if stop.is_set():
+                    break
+                image_bytes, extract_ms = extract_page_image(doc[i], dpi)
+                rendered.put((i, image_bytes, extract_ms))
+        except Exception as e:
+            failure.append(e)
+        finally:
+            rendered.put(None)
+
+    producer = threading.Thread(target=render, daemon=True)
+    producer.start()
+
+    results = []
+    done = False
+    try:
+        while not done:
+            # Take whatever else is already rendered too, so one tesseract run
+            # covers several pages without stalling on the renderer
+            batch = [rendered.get()]
+            while len(batch) < OCR_BATCH_PAGES and not rendered.empty():
+                batch.append(rendered.get())
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            if batch:
+                results.extend(ocr_images(batch))
+    finally:
+        # On an OCR error, stop the producer and drain so it can't block on put()
+        stop.set()
+        while not done:
+            done = rendered.get() is None
+        producer.join()
+
+    if failure:
+        raise failure[0]
+    return results
+
+
+def ocr_doc_pages(doc, indices, dpi: int = 300, parallel: bool = True) -> list[tuple]:
+    """
+    Render and OCR the given pages of an open document, in order.
+    parallel=False renders a batch of pages, OCRs it, then moves on.
+    """
+    if parallel:
+        return _run_pipeline(doc, indices, dpi)
+    results = []
+    for start in range(0, len(indices), OCR_BATCH_PAGES):
+        batch = []
+        for i in indices[start:start + OCR_BATCH_PAGES]:
+            image_bytes, extract_ms = extract_page_image(doc[i], dpi)
+            batch.append((i, image_bytes, extract_ms))
+        results.extend(ocr_images(batch))
+    return results
+
+
+def partition_pages(num_pages: int, chunk_size: int) -> list[range]:
+    """Split pages 0..num_pages-1 into consecutive ranges of at most chunk_size pages."""
+    return [range(i, min(i + chunk_size, num_pages)) for i in range(0, num_pages, chunk_size)]
+
+
+def chunk_size_for(num_pages: int, workers: int) -> int:
+    """
+    Pages per pool task. Chunks smaller than an even split let cores that
+    finish early pick up more work; very long documents get bigger chunks
+    so per-task overhead stays small next to the OCR.
+    """
+    size = PAGE_CHUNK_SIZE * 4 if num_pages > 1000 else PAGE_CHUNK_SIZE
+    return min(size, -(-num_pages // workers))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context("forkserver"))
+        return _pool
+
+
+def _ocr_chunk(pdf_path: str, indices, dpi: int) -> list[tuple]:
+    # fitz documents can't be pickled across processes, so each task opens
+    # the request's spooled copy by path (that only parses the xref)
+    doc = fitz.open(pdf_path, filetype="pdf")
+    try:
+        return ocr_doc_pages(doc, indices, dpi)
+    finally:
+        doc.close()
+
+
+def run_parallel_ocr(pdf_bytes: bytes, ranges: list[range], dpi: int = 300) -> list[tuple]:
+    """OCR each range of pages as a task on the shared worker pool. Results come back in page order."""
+    global _pool
+    pool = _get_pool()
+    n = len(ranges)
+    # Spool the PDF to /tmp once so tasks carry a path, not a pickled copy each
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        f.write(pdf_bytes)
+        f.flush()
+        try:
+            # map() yields the chunks back in the order of ranges
+            return [r for chunk in pool.map(_ocr_chunk, [f.name] * n, ranges, [dpi] * n) for r in chunk]
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault); the next request starts a fresh pool
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+            raise
 
 
 def pdf_ocr_handler(event, context):
@@ -57,61 +458,60 @@ def pdf_ocr_handler(event, context):
         pdf_data = payload.get("pdf", "")
         filename = payload.get("filename", "unknown.pdf")
         dpi = payload.get("dpi", 300)
+        parallel = payload.get("parallel", True)
 
         if not pdf_data:
             return {"error": "No PDF data provided"}
 
-        # Strip data URL prefix if present
-        if "," in pdf_data:
-            pdf_data = pdf_data.split(",", 1)[1]
-
-        pdf_bytes = base64.b64decode(pdf_data)
+        effective_dpi = dpi
+        if dpi > MAX_OCR_DPI and not payload.get("force_dpi"):
+            logger.warning("Rendering %s at %d DPI instead of the requested %d", filename, MAX_OCR_DPI, dpi)
+            effective_dpi = MAX_OCR_DPI
 
-        # Write PDF to temp file
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(pdf_bytes)
-            pdf_path = tmp.name
-
-        total_start = time.time()
-
-        doc = fitz.open(pdf_path)
-        page_count = len(doc)
-
-        pages = []
+        # Strip data URL prefix if present
+        _, sep, encoded = pdf_data.partition(",")
+        if sep:
+            pdf_data = encoded
+
+        # The C decoder b64decode wraps, minus its per-call argument handling
+        pdf_bytes = binascii.a2b_base64(pdf_data)
+
+        total_start = time.perf_counter_ns()
+
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page_count = len(doc)
+
+            # Chunks of pages across the cores; tesseract is CPU-bound per
+            # page, so N pages on M cores take ~N/min(N, M) page-times. Each
+            # worker also overlaps its own rendering with OCR (see _run_pipeline).
+            workers = min(page_count, POOL_WORKERS) if parallel else 1
+            if workers > 1:
+                ranges = partition_pages(page_count, chunk_size_for(page_count, workers))
+                results = run_parallel_ocr(pdf_bytes, ranges, effective_dpi)
+            else:
+                results = ocr_doc_pages(doc, range(page_count), effective_dpi, parallel)
+        finally:
+            doc.close()
+
+        pages = [None] * page_count
         full_text_parts = []
         total_word_count = 0
         total_char_count = 0
         total_extract_ms = 0
         total_ocr_ms = 0
 
-        for i, page in enumerate(doc):
-            page_start = time.time()
-
-            # Step 1: Render page to image
-            png_bytes, extract_ms = extract_page_image(page, dpi)
+        for i, text, image_size, extract_ms, ocr_ms, page_total_ms, cache_hit, skipped_blank in results:
             total_extract_ms += extract_ms
-
-            # Write image to temp file for Tesseract
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as img_tmp:
-                img_tmp.write(png_bytes)
-                img_path = img_tmp.name
-
-            # Step 2: OCR the rendered image
-            text, ocr_ms = run_tesseract(img_path)
             total_ocr_ms += ocr_ms
 
-            # Clean up temp image
-            os.unlink(img_path)
-
-            page_total_ms = round((time.time() - page_start) * 1000, 2)
-
             word_count = len(text.split()) if text else 0
             char_count = len(text)
             total_word_count += word_count
             total_char_count += char_count
             full_text_parts.append(text)
 
-            pages.append({
+            pages[i] = {
                 "page": i + 1,
                 "text": text,
                 "word_count": word_count,
@@ -119,13 +519,12 @@ def pdf_ocr_handler(event, context):
                 "image_extract_ms": extract_ms,
                 "ocr_ms": ocr_ms,
                 "page_total_ms": page_total_ms,
-                "image_size_bytes": len(png_bytes),
-            })
+                "image_size_bytes": image_size,
+                "cache_hit": cache_hit,
+                "skipped_blank": skipped_blank,
+            }
 
-        doc.close()
-        os.unlink(pdf_path)
-
-        pipeline_ms = round((time.time() - total_start) * 1000, 2)
+        pipeline_ms = round((time.perf_counter_ns() - total_start) / 1e6, 2)
         full_text = "\n\n".join(full_text_parts)
 
         return {
@@ -143,8 +542,17 @@ def pdf_ocr_handler(event, context):
             },
             "pdf_size_bytes": len(pdf_bytes),
             "dpi": dpi,
+            "effective_dpi": effective_dpi,
             "pages": pages,
         }
 
     except Exception as e:
         return {"error": str(e)}
+
+
+def pdf_ocr_handler_json(event, context) -> bytes:
+    """pdf_ocr_handler, serialised to a JSON body (orjson when installed) for API Gateway."""
+    result = pdf_ocr_handler(event, context)
+    if orjson is not None:
+        return orjson.dumps(result)
+    return json.dumps(result).encode()
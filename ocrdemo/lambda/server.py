@@ -6,17 +6,17 @@ Routes:
   POST /2015-03-31/functions/pdf-ocr/invocations         → PDF → Image → OCR pipeline
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from handler import lambda_handler
 from pdf_handler import pdf_handler
-from pdf_ocr_handler import pdf_ocr_handler
+from pdf_ocr_handler import pdf_ocr_handler_json
 
 app = Flask(__name__)
 
 HANDLERS = {
     "ocr-service": lambda_handler,
     "pdf-extract": pdf_handler,
-    "pdf-ocr": pdf_ocr_handler,
+    "pdf-ocr": pdf_ocr_handler_json,
 }
 
 
@@ -29,6 +29,8 @@ def invoke(function_name):
     try:
         event = request.get_json(force=True)
         result = handler(event, None)
+        if isinstance(result, bytes):  # handler serialised its own JSON
+            return Response(result, 200, mimetype="application/json")
         return jsonify(result), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -4,228 +4,182 @@ Uses unittest.mock to patch PyMuPDF (fitz) so no real PDFs are needed.
 """
 
 import base64
-import os
-from unittest.mock import patch, MagicMock, PropertyMock
+import functools
+from types import SimpleNamespace
 
 import pytest
 
-import sys
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 from pdf_handler import pdf_handler
 
+# Every test runs with the handler's temp file redirected into tmp_path and
+# its fitz module patched (see conftest.fake_tmp / conftest.mocks);
+# HANDLER_MODULE and HANDLER_PATCHES tell those fixtures what to patch.
+HANDLER_MODULE = "pdf_handler"
+HANDLER_PATCHES = ("fitz",)
+pytestmark = pytest.mark.usefixtures("fake_tmp", "mocks")
+
 
 # ---------------------------------------------------------------------------
 # Fixtures / helpers
 # ---------------------------------------------------------------------------
 
-def _b64_pdf(raw: bytes = b"%PDF-1.4 fake pdf content") -> str:
-    return base64.b64encode(raw).decode()
+# Encoded once at import; every test sends the same bytes.
+_B64_PDF = base64.b64encode(b"%PDF-1.4 fake pdf content").decode()
+_B64_PDF_PREFIXED = f"data:application/pdf;base64,{_B64_PDF}"
+_RAW_PDF = b"%PDF raw data here"
+_B64_RAW_PDF = base64.b64encode(_RAW_PDF).decode()
+
 
+@functools.lru_cache(maxsize=None)
+def _mock_page(text: str = "Page text"):
+    """Create a fake fitz page that returns given text.
 
-def _b64_pdf_with_prefix(raw: bytes = b"%PDF-1.4 fake pdf") -> str:
-    return f"data:application/pdf;base64,{base64.b64encode(raw).decode()}"
+    Cached per text: pages are stateless, so repeated texts share one object.
+    """
+    return SimpleNamespace(get_text=lambda *args: text)
 
 
-def _mock_page(text: str = "Page text"):
-    """Create a mock fitz page that returns given text."""
-    page = MagicMock()
-    page.get_text.return_value = text
-    return page
+class _FakeDoc:
+    """Just enough of fitz.Document for pdf_handler: len, iteration and close."""
+    __slots__ = ("pages",)
+
+    def __init__(self, pages_text):
+        # Built once; iter() over a tuple is a plain C-level iterator
+        self.pages = tuple(_mock_page(t) for t in pages_text)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
 
 
 def _mock_document(pages_text: list[str]):
-    """Create a mock fitz.Document with given page texts."""
-    pages = [_mock_page(t) for t in pages_text]
-    doc = MagicMock()
-    doc.__len__ = lambda self: len(pages)
-    doc.__iter__ = lambda self: iter(pages)
-    doc.__enter__ = lambda self: self
-    doc.__exit__ = MagicMock(return_value=False)
-    doc.close = MagicMock()
-    return doc
+    """Create a fake fitz.Document with given page texts."""
+    return _FakeDoc(pages_text)
 
 
 # ---------------------------------------------------------------------------
 # Tests – successful extraction
 # ---------------------------------------------------------------------------
 
-class TestPdfHandlerSuccess:
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_single_page_extraction(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
-
-        mock_fitz_open.return_value = _mock_document(["Hello from page 1"])
-
-        result = pdf_handler({"pdf": _b64_pdf(), "filename": "test.pdf"}, None)
-
-        assert result["text"] == "Hello from page 1"
-        assert result["page_count"] == 1
-        assert result["total_word_count"] == 4
-        assert result["filename"] == "test.pdf"
-        assert "processing_time_ms" in result
-        assert len(result["pages"]) == 1
-        assert result["pages"][0]["page"] == 1
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_multi_page_extraction(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
-
-        mock_fitz_open.return_value = _mock_document([
-            "First page content",
-            "Second page content",
-            "Third page content",
-        ])
-
-        result = pdf_handler({"pdf": _b64_pdf(), "filename": "multi.pdf"}, None)
-
-        assert result["page_count"] == 3
-        assert len(result["pages"]) == 3
-        assert "First page content" in result["text"]
-        assert "Third page content" in result["text"]
-        # Pages joined by double-newline
-        assert "\n\n" in result["text"]
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_strips_data_url_prefix(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
-
-        mock_fitz_open.return_value = _mock_document(["Prefix test"])
-
-        result = pdf_handler({"pdf": _b64_pdf_with_prefix(), "filename": "prefix.pdf"}, None)
-
-        assert result["text"] == "Prefix test"
-        assert "error" not in result
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_word_and_char_counts(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
-
-        mock_fitz_open.return_value = _mock_document(["One two three", "Four five"])
-
-        result = pdf_handler({"pdf": _b64_pdf(), "filename": "counts.pdf"}, None)
-
-        assert result["total_word_count"] == 5
-        assert result["pages"][0]["word_count"] == 3
-        assert result["pages"][1]["word_count"] == 2
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_default_filename(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
-
-        mock_fitz_open.return_value = _mock_document(["text"])
-
-        result = pdf_handler({"pdf": _b64_pdf()}, None)
-        assert result["filename"] == "unknown.pdf"
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_file_size_bytes(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
-
-        mock_fitz_open.return_value = _mock_document(["text"])
-        raw = b"%PDF raw data here"
-
-        result = pdf_handler({"pdf": base64.b64encode(raw).decode()}, None)
-        assert result["file_size_bytes"] == len(raw)
+
+@pytest.mark.parametrize("event, page_text, expected_filename", [
+    pytest.param(
+        {"pdf": _B64_PDF, "filename": "test.pdf"},
+        "Hello from page 1", "test.pdf", id="single_page_extraction"),
+    pytest.param(
+        {"pdf": _B64_PDF_PREFIXED, "filename": "prefix.pdf"},
+        "Prefix test", "prefix.pdf", id="strips_data_url_prefix"),
+    pytest.param(
+        {"pdf": _B64_PDF}, "text", "unknown.pdf", id="default_filename"),
+])
+def test_extraction(mocks, event, page_text, expected_filename):
+    mocks["fitz"].open.return_value = _mock_document([page_text])
+
+    result = pdf_handler(event, None)
+
+    assert "error" not in result
+    assert result["text"] == page_text
+    assert result["page_count"] == 1
+    assert result["total_word_count"] == len(page_text.split())
+    assert result["filename"] == expected_filename
+    assert "processing_time_ms" in result
+    assert len(result["pages"]) == 1
+    assert result["pages"][0]["page"] == 1
+
+
+def test_multi_page_extraction(mocks):
+    mocks["fitz"].open.return_value = _mock_document([
+        "First page content",
+        "Second page content",
+        "Third page content",
+    ])
+
+    result = pdf_handler({"pdf": _B64_PDF, "filename": "multi.pdf"}, None)
+
+    assert result["page_count"] == 3
+    assert len(result["pages"]) == 3
+    assert "First page content" in result["text"]
+    assert "Third page content" in result["text"]
+    # Pages joined by double-newline
+    assert "\n\n" in result["text"]
+
+
+def test_word_and_char_counts(mocks):
+    mocks["fitz"].open.return_value = _mock_document(["One two three", "Four five"])
+
+    result = pdf_handler({"pdf": _B64_PDF, "filename": "counts.pdf"}, None)
+
+    assert result["total_word_count"] == 5
+    assert result["pages"][0]["word_count"] == 3
+    assert result["pages"][1]["word_count"] == 2
+
+
+def test_file_size_bytes(mocks):
+    mocks["fitz"].open.return_value = _mock_document(["text"])
+
+    result = pdf_handler({"pdf": _B64_RAW_PDF}, None)
+    assert result["file_size_bytes"] == len(_RAW_PDF)
 
 
 # ---------------------------------------------------------------------------
 # Tests – error handling
 # ---------------------------------------------------------------------------
 
-class TestPdfHandlerErrors:
 
-    def test_no_pdf_data(self):
-        result = pdf_handler({"pdf": "", "filename": "empty.pdf"}, None)
-        assert result == {"error": "No PDF data provided"}
+def test_no_pdf_data():
+    result = pdf_handler({"pdf": "", "filename": "empty.pdf"}, None)
+    assert result == {"error": "No PDF data provided"}
+
 
-    def test_missing_pdf_key(self):
-        result = pdf_handler({"filename": "nopdf.pdf"}, None)
-        assert result == {"error": "No PDF data provided"}
+def test_missing_pdf_key():
+    result = pdf_handler({"filename": "nopdf.pdf"}, None)
+    assert result == {"error": "No PDF data provided"}
 
-    def test_invalid_base64(self):
-        result = pdf_handler({"pdf": "!!!bad_base64!!!", "filename": "bad.pdf"}, None)
-        assert "error" in result
 
-    @patch("pdf_handler.fitz.open", side_effect=Exception("corrupt PDF"))
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_fitz_open_failure(self, mock_tmp, mock_fitz_open):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
+def test_invalid_base64():
+    result = pdf_handler({"pdf": "!!!bad_base64!!!", "filename": "bad.pdf"}, None)
+    assert "error" in result
 
-        result = pdf_handler({"pdf": _b64_pdf(), "filename": "corrupt.pdf"}, None)
-        assert result == {"error": "corrupt PDF"}
+
+def test_fitz_open_failure(mocks):
+    mocks["fitz"].open.side_effect = Exception("corrupt PDF")
+
+    result = pdf_handler({"pdf": _B64_PDF, "filename": "corrupt.pdf"}, None)
+    assert result == {"error": "corrupt PDF"}
 
 
 # ---------------------------------------------------------------------------
 # Tests – edge cases
 # ---------------------------------------------------------------------------
 
-class TestPdfHandlerEdgeCases:
-
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_empty_page_text(self, mock_tmp, mock_fitz_open, mock_unlink):
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
 
-        mock_fitz_open.return_value = _mock_document(["", ""])
+def test_empty_page_text(mocks):
+    mocks["fitz"].open.return_value = _mock_document(["", ""])
 
-        result = pdf_handler({"pdf": _b64_pdf(), "filename": "empty_pages.pdf"}, None)
+    result = pdf_handler({"pdf": _B64_PDF, "filename": "empty_pages.pdf"}, None)
 
-        assert result["total_word_count"] == 0
-        assert result["page_count"] == 2
-        assert result["pages"][0]["word_count"] == 0
+    assert result["total_word_count"] == 0
+    assert result["page_count"] == 2
+    assert result["pages"][0]["word_count"] == 0
 
-    @patch("pdf_handler.os.unlink")
-    @patch("pdf_handler.fitz.open")
-    @patch("pdf_handler.tempfile.NamedTemporaryFile")
-    def test_page_extraction_timing(self, mock_tmp, mock_fitz_open, mock_unlink):
-        """Each page should have its own extraction_time_ms."""
-        mock_tmp.return_value.__enter__ = lambda s: s
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-        mock_tmp.return_value.name = "/tmp/fake.pdf"
-        mock_tmp.return_value.write = MagicMock()
 
-        mock_fitz_open.return_value = _mock_document(["a", "b"])
+def test_page_extraction_timing(mocks):
+    """Each page should have its own extraction_time_ms."""
+    mocks["fitz"].open.return_value = _mock_document(["a", "b"])
 
-        result = pdf_handler({"pdf": _b64_pdf()}, None)
+    result = pdf_handler({"pdf": _B64_PDF}, None)
 
-        for page in result["pages"]:
-            assert "extraction_time_ms" in page
-            assert isinstance(page["extraction_time_ms"], float)
+    for page in result["pages"]:
+        assert "extraction_time_ms" in page
+        assert isinstance(page["extraction_time_ms"], float)
@@ -4,20 +4,40 @@ Mocks both PyMuPDF (fitz) and Tesseract subprocess calls.
 """
 
 import base64
+import hashlib
+import json
 import os
-from unittest.mock import patch, MagicMock, call
+import struct
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
 
+import fitz
 import pytest
 
-import sys
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from pdf_ocr_handler import pdf_ocr_handler, run_tesseract, extract_page_image
+import pdf_ocr_handler as handler_module
+from pdf_ocr_handler import (
+    pdf_ocr_handler, pdf_ocr_handler_json, run_tesseract, run_tesseract_batch, pgm_pages_to_tiff,
+    extract_page_image, cached_ocr,
+    partition_pages, chunk_size_for, run_parallel_ocr, is_blank_page,
+)
 
 
 # ---------------------------------------------------------------------------
 # Fixtures / helpers
 # ---------------------------------------------------------------------------
 
+@pytest.fixture(autouse=True)
+def _fresh_ocr_cache(tmp_path, monkeypatch):
+    """Each test starts with an empty OCR cache on its own disk tier.
+
+    tesserocr is switched off too, so OCR goes through the mocked subprocess
+    even where it's installed; tests opt back in by patching PyTessBaseAPI.
+    """
+    monkeypatch.setattr(handler_module, "OCR_CACHE_DIR", str(tmp_path / "ocr_cache"))
+    monkeypatch.setattr(handler_module, "PyTessBaseAPI", None)
+    handler_module._ocr_cache.clear()
+
+
 def _b64_pdf(raw: bytes = b"%PDF-1.4 fake") -> str:
     return base64.b64encode(raw).decode()
 
@@ -26,31 +46,43 @@ def _b64_pdf_with_prefix(raw: bytes = b"%PDF-1.4 fake") -> str:
     return f"data:application/pdf;base64,{base64.b64encode(raw).decode()}"
 
 
-def _mock_pixmap(png_bytes: bytes = b"\x89PNG fake image"):
+def _pgm(fill: int = 0, width: int = 3, height: int = 2) -> bytes:
+    return b"P5\n%d %d\n255\n" % (width, height) + bytes([fill]) * (width * height)
+
+
+def _mock_pixmap(image_bytes: bytes = _pgm()):
     pix = MagicMock()
-    pix.tobytes.return_value = png_bytes
+    pix.tobytes.return_value = image_bytes
     return pix
 
 
-def _mock_page(png_bytes: bytes = b"\x89PNG fake image"):
+def _mock_page(image_bytes: bytes = _pgm()):
     page = MagicMock()
-    page.get_pixmap.return_value = _mock_pixmap(png_bytes)
+    page.get_pixmap.return_value = _mock_pixmap(image_bytes)
     return page
 
 
-def _mock_document(num_pages: int = 1, png_bytes: bytes = b"\x89PNG fake"):
-    pages = [_mock_page(png_bytes) for _ in range(num_pages)]
+def _mock_document(num_pages: int = 1, image_bytes: bytes = _pgm()):
+    pages = [_mock_page(image_bytes) for _ in range(num_pages)]
     doc = MagicMock()
     doc.__len__ = lambda self: len(pages)
     doc.__iter__ = lambda self: iter(pages)
+    doc.__getitem__ = lambda self, i: pages[i]
     doc.close = MagicMock()
     return doc
 
 
+class _InlineExecutor:
+    """Stands in for the shared process pool so pages run in-process against the mocks."""
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+
 def _mock_subprocess_result(stdout="OCR text", stderr="", returncode=0):
     result = MagicMock()
-    result.stdout = stdout
-    result.stderr = stderr
+    result.stdout = stdout.encode()
+    result.stderr = stderr.encode()
     result.returncode = returncode
     return result
 
@@ -65,13 +97,15 @@ class TestRunTesseract:
     def test_successful_ocr(self, mock_run):
         mock_run.return_value = _mock_subprocess_result(stdout="  Hello World  ")
 
-        text, elapsed = run_tesseract("/tmp/test.png")
+        text, elapsed = run_tesseract(b"fake pgm")
 
         assert text == "Hello World"  # stripped
         assert elapsed >= 0
         mock_run.assert_called_once()
         args = mock_run.call_args
         assert "tesseract" in args[0][0]
+        assert args[0][0][1:3] == ["stdin", "stdout"]
+        assert args.kwargs["input"] == b"fake pgm"
 
     @patch("pdf_ocr_handler.subprocess.run")
     def test_tesseract_failure_raises(self, mock_run):
@@ -80,7 +114,7 @@ class TestRunTesseract:
         )
 
         with pytest.raises(RuntimeError, match="Tesseract failed"):
-            run_tesseract("/tmp/bad.png")
+            run_tesseract(b"bad pgm")
 
     @patch("pdf_ocr_handler.subprocess.run")
     def test_nonzero_returncode_with_text_succeeds(self, mock_run):
@@ -89,7 +123,7 @@ class TestRunTesseract:
             stdout="partial text", stderr="warning", returncode=1
         )
 
-        text, elapsed = run_tesseract("/tmp/warn.png")
+        text, elapsed = run_tesseract(b"warn pgm")
         assert text == "partial text"
 
 
@@ -99,14 +133,16 @@ class TestRunTesseract:
 
 class TestExtractPageImage:
 
-    def test_renders_page_to_png(self):
-        page = _mock_page(b"\x89PNG rendered image bytes")
+    def test_renders_page_to_pgm(self):
+        page = _mock_page(b"P5 rendered image bytes")
 
-        png_bytes, elapsed = extract_page_image(page, dpi=300)
+        image_bytes, elapsed = extract_page_image(page, dpi=300)
 
-        assert png_bytes == b"\x89PNG rendered image bytes"
+        assert image_bytes == b"P5 rendered image bytes"
         assert elapsed >= 0
         page.get_pixmap.assert_called_once()
+        assert page.get_pixmap.call_args.kwargs["colorspace"] == fitz.csGRAY
+        page.get_pixmap.return_value.tobytes.assert_called_with("pgm")
 
     def test_custom_dpi(self):
         page = _mock_page()
@@ -118,6 +154,250 @@ class TestExtractPageImage:
         call_kwargs = page.get_pixmap.call_args
         assert "matrix" in call_kwargs.kwargs or len(call_kwargs.args) > 0
 
+    def test_matrix_reused_per_dpi(self, monkeypatch):
+        monkeypatch.setattr(handler_module, "_matrix_cache", {})
+
+        with patch("pdf_ocr_handler.fitz.Matrix") as mock_matrix:
+            extract_page_image(_mock_page(), dpi=200)
+            extract_page_image(_mock_page(), dpi=200)
+            extract_page_image(_mock_page(), dpi=150)
+
+        assert mock_matrix.call_count == 2
+
+
+# ---------------------------------------------------------------------------
+# Tests – OCR cache
+# ---------------------------------------------------------------------------
+
+class TestOcrCache:
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_identical_pages_ocr_once(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="cached text")
+        image_bytes = _mock_page().get_pixmap().tobytes("pgm")
+
+        [first] = cached_ocr([image_bytes])
+        [second] = cached_ocr([image_bytes])
+
+        assert mock_run.call_count == 1
+        assert first[0] == second[0] == "cached text"
+        assert (first[2], second[2]) == (False, True)
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_disk_tier_survives_memory_eviction(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="on disk")
+
+        cached_ocr([b"page bytes"])
+        handler_module._ocr_cache.clear()
+        [(text, _, hit)] = cached_ocr([b"page bytes"])
+
+        assert mock_run.call_count == 1
+        assert (text, hit) == ("on disk", True)
+        assert len(os.listdir(handler_module.OCR_CACHE_DIR)) == 1
+
+    @patch("pdf_ocr_handler.OCR_CACHE_DISK_FILES", 2)
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_disk_tier_evicts_oldest(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="x")
+
+        for n in range(4):
+            cached_ocr([b"page %d" % n])
+            # Distinct mtimes even on coarse-grained filesystems
+            path = os.path.join(handler_module.OCR_CACHE_DIR, hashlib.sha256(b"page %d" % n).hexdigest() + ".txt")
+            os.utime(path, (n, n))
+
+        assert sorted(os.listdir(handler_module.OCR_CACHE_DIR)) == sorted(
+            hashlib.sha256(b"page %d" % n).hexdigest() + ".txt" for n in (2, 3)
+        )
+
+    @patch("pdf_ocr_handler.OCR_CACHE_SIZE", 2)
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_memory_tier_is_bounded(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="x")
+
+        for n in range(5):
+            cached_ocr([b"page %d" % n])
+
+        assert list(handler_module._ocr_cache) == [
+            hashlib.sha256(b"page %d" % n).hexdigest() for n in (3, 4)
+        ]
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_batch_only_sends_misses(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="one")
+        cached_ocr([_pgm(1)])
+
+        mock_run.return_value = _mock_subprocess_result(stdout="two\fthree\f")
+        results = cached_ocr([_pgm(1), _pgm(2), _pgm(3), _pgm(2)])
+
+        assert mock_run.call_count == 2
+        assert mock_run.call_args.kwargs["input"] == pgm_pages_to_tiff([_pgm(2), _pgm(3)])
+        assert [(text, hit) for text, _, hit in results] == [
+            ("one", True), ("two", False), ("three", False), ("two", False)
+        ]
+
+
+# ---------------------------------------------------------------------------
+# Tests – batched OCR
+# ---------------------------------------------------------------------------
+
+class TestRunTesseractBatch:
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_one_tesseract_run_per_batch(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="first\n\fsecond\n\fthird\n\f")
+
+        texts, elapsed = run_tesseract_batch([_pgm(1), _pgm(2), _pgm(3)])
+
+        assert texts == ["first", "second", "third"]
+        assert elapsed >= 0
+        mock_run.assert_called_once()
+        assert mock_run.call_args.kwargs["input"][:4] == b"II*\x00"
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_blank_page_keeps_alignment(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="\fsecond\f")
+
+        texts, _ = run_tesseract_batch([_pgm(1), _pgm(2)])
+        assert texts == ["", "second"]
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_single_image_sent_as_is(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="only")
+
+        texts, _ = run_tesseract_batch([_pgm(1)])
+
+        assert texts == ["only"]
+        assert mock_run.call_args.kwargs["input"] == _pgm(1)
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_missing_pages_raise(self, mock_run):
+        mock_run.return_value = _mock_subprocess_result(stdout="just one")
+
+        with pytest.raises(RuntimeError, match="returned 1 pages for 2 images"):
+            run_tesseract_batch([_pgm(1), _pgm(2)])
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    def test_tesserocr_keeps_model_in_process(self, mock_run, monkeypatch):
+        api = MagicMock()
+        api.GetUTF8Text.side_effect = ["first\n", "second\n"]
+        mock_api_cls = MagicMock(return_value=api)
+        monkeypatch.setattr(handler_module, "_tess_local", SimpleNamespace())
+        monkeypatch.setattr(handler_module, "PyTessBaseAPI", mock_api_cls)
+        monkeypatch.setattr(handler_module, "PSM", SimpleNamespace(AUTO=3), raising=False)
+        monkeypatch.setattr(handler_module, "OEM", SimpleNamespace(LSTM_ONLY=1), raising=False)
+
+        texts, _ = run_tesseract_batch([_pgm(1), _pgm(2)])
+
+        assert texts == ["first", "second"]
+        mock_run.assert_not_called()
+        mock_api_cls.assert_called_once()
+        api.SetImageBytes.assert_called_with(bytes([2]) * 6, 3, 2, 1, 3)
+
+    def test_tiff_layout(self):
+        tiff = pgm_pages_to_tiff([_pgm(7, width=3, height=1), _pgm(9, width=2, height=2)])
+
+        assert tiff[:4] == b"II*\x00"
+        first_ifd = struct.unpack_from("<I", tiff, 4)[0]
+        assert tiff[8:11] == b"\x07\x07\x07"  # first page's raster, right after the header
+        entries = struct.unpack_from("<H", tiff, first_ifd)[0]
+        second_ifd = struct.unpack_from("<I", tiff, first_ifd + 2 + 12 * entries)[0]
+        assert second_ifd % 2 == 0
+        last_link = second_ifd + 2 + 12 * entries
+        assert struct.unpack_from("<I", tiff, last_link)[0] == 0
+        assert len(tiff) == last_link + 4
+
+
+# ---------------------------------------------------------------------------
+# Tests – blank page detection
+# ---------------------------------------------------------------------------
+
+class TestBlankPageSkip:
+
+    def test_detects_blank_and_inked_pages(self):
+        assert is_blank_page(_pgm(0xFF, width=100, height=100))
+        assert is_blank_page(_pgm(0xF0, width=100, height=100))  # off-white paper
+        assert not is_blank_page(_pgm(0x00, width=100, height=100))
+
+    def test_tolerates_specks(self):
+        page = bytearray(_pgm(0xFF, width=1000, height=1000))
+        page[-20:] = bytes(20)  # 20 dark pixels of a million
+        assert is_blank_page(bytes(page))
+        page[-100:] = bytes(100)
+        assert not is_blank_page(bytes(page))
+
+    @patch("pdf_ocr_handler.POOL_WORKERS", 1)
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_blank_pages_skip_ocr(self, mock_fitz_open, mock_run):
+        mock_fitz_open.return_value = _mock_document(num_pages=2, image_bytes=_pgm(0xFF))
+
+        result = pdf_ocr_handler({"pdf": _b64_pdf()}, None)
+
+        assert mock_run.call_count == 0
+        assert result["text"] == "\n\n"
+        assert [p["skipped_blank"] for p in result["pages"]] == [True, True]
+        assert result["total_word_count"] == 0
+        assert handler_module._ocr_cache == {}
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_mixed_batch_only_ocrs_inked_pages(self, mock_fitz_open, mock_run):
+        doc = _mock_document(num_pages=3)
+        for page, image in zip(doc, (_pgm(0), _pgm(0xFF), _pgm(9))):
+            page.get_pixmap.return_value = _mock_pixmap(image)
+        mock_fitz_open.return_value = doc
+        mock_run.return_value = _mock_subprocess_result(stdout="first\fthird\f")
+
+        result = pdf_ocr_handler({"pdf": _b64_pdf(), "parallel": False}, None)
+
+        assert mock_run.call_count == 1
+        assert mock_run.call_args.kwargs["input"] == pgm_pages_to_tiff([_pgm(0), _pgm(9)])
+        assert [p["text"] for p in result["pages"]] == ["first", "", "third"]
+
+
+# ---------------------------------------------------------------------------
+# Tests – page partitioning
+# ---------------------------------------------------------------------------
+
+class TestPartitioning:
+
+    def test_partition_pages(self):
+        assert partition_pages(25, 10) == [range(0, 10), range(10, 20), range(20, 25)]
+
+    def test_partition_exact_and_empty(self):
+        assert partition_pages(20, 10) == [range(0, 10), range(10, 20)]
+        assert partition_pages(0, 10) == []
+
+    def test_chunk_size_spreads_short_documents(self):
+        assert chunk_size_for(8, 4) == 2
+        assert chunk_size_for(3, 4) == 1
+        assert chunk_size_for(200, 4) == 10
+
+    def test_chunk_size_grows_for_long_documents(self):
+        assert chunk_size_for(1500, 4) > chunk_size_for(900, 4)
+
+    @patch("pdf_ocr_handler._get_pool", _InlineExecutor)
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_run_parallel_ocr_keeps_page_order(self, mock_fitz_open, mock_run):
+        doc = _mock_document(num_pages=5)
+        for n, page in enumerate(doc):
+            page.get_pixmap.return_value = _mock_pixmap(_pgm(n))
+        mock_fitz_open.return_value = doc
+        # One page per chunk, so every tesseract call gets a single PGM
+        mock_run.side_effect = lambda cmd, input, **kw: _mock_subprocess_result(stdout=f"page {input[-1]}")
+
+        results = run_parallel_ocr(b"%PDF", partition_pages(5, 1), dpi=100)
+
+        assert [r[0] for r in results] == [0, 1, 2, 3, 4]
+        assert [r[1] for r in results] == ["page 0", "page 1", "page 2", "page 3", "page 4"]
+        # Every task opens (and closes) the one spooled copy, which is gone afterwards
+        paths = {c.args[0] for c in mock_fitz_open.call_args_list}
+        assert mock_fitz_open.call_count == 5 and len(paths) == 1
+        assert not os.path.exists(paths.pop())
+        assert doc.close.call_count == 5
+
 
 # ---------------------------------------------------------------------------
 # Tests – pdf_ocr_handler (full pipeline)
@@ -125,18 +405,9 @@ class TestExtractPageImage:
 
 class TestPdfOcrHandlerSuccess:
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_single_page_pipeline(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        # Set up temp file mock
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_single_page_pipeline(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=1)
         mock_run.return_value = _mock_subprocess_result(stdout="Extracted from image")
 
@@ -151,18 +422,14 @@ class TestPdfOcrHandlerSuccess:
         assert "timing" in result
         assert "pipeline_ms" in result["timing"]
         assert len(result["pages"]) == 1
+        # Opened from memory; nothing is written to disk first
+        assert mock_fitz_open.call_args.kwargs["stream"] == b"%PDF-1.4 fake"
 
-    @patch("pdf_ocr_handler.os.unlink")
+    @patch("pdf_ocr_handler._get_pool", _InlineExecutor)
+    @patch("pdf_ocr_handler.POOL_WORKERS", 4)
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_multi_page_pipeline(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_multi_page_pipeline(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=3)
         mock_run.return_value = _mock_subprocess_result(stdout="Page text")
 
@@ -174,17 +441,9 @@ class TestPdfOcrHandlerSuccess:
         assert result["text"].count("Page text") == 3
         assert result["total_word_count"] == 6  # 2 words × 3 pages
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_strips_data_url_prefix(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_strips_data_url_prefix(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=1)
         mock_run.return_value = _mock_subprocess_result(stdout="prefix test")
 
@@ -195,18 +454,11 @@ class TestPdfOcrHandlerSuccess:
         assert result["text"] == "prefix test"
         assert "error" not in result
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_custom_dpi(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
-        mock_fitz_open.return_value = _mock_document(num_pages=1)
+    def test_custom_dpi(self, mock_fitz_open, mock_run):
+        doc = _mock_document(num_pages=1)
+        mock_fitz_open.return_value = doc
         mock_run.return_value = _mock_subprocess_result(stdout="hi-res")
 
         result = pdf_ocr_handler(
@@ -214,18 +466,28 @@ class TestPdfOcrHandlerSuccess:
         )
 
         assert result["dpi"] == 600
+        # Clamped: 400 DPI is under half the pixels of 600
+        assert result["effective_dpi"] == 400
+        matrix = doc[0].get_pixmap.call_args.kwargs["matrix"]
+        assert (matrix.a, matrix.d) == (400 / 72, 400 / 72)
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_timing_breakdown(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
+    def test_force_dpi(self, mock_fitz_open, mock_run):
+        doc = _mock_document(num_pages=1)
+        mock_fitz_open.return_value = doc
+        mock_run.return_value = _mock_subprocess_result(stdout="hi-res")
+
+        result = pdf_ocr_handler({"pdf": _b64_pdf(), "dpi": 600, "force_dpi": True}, None)
+
+        assert result["effective_dpi"] == 600
+        assert doc[0].get_pixmap.call_args.kwargs["matrix"].a == 600 / 72
 
+    @patch("pdf_ocr_handler._get_pool", _InlineExecutor)
+    @patch("pdf_ocr_handler.POOL_WORKERS", 4)
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_timing_breakdown(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=2)
         mock_run.return_value = _mock_subprocess_result(stdout="text")
 
@@ -238,18 +500,10 @@ class TestPdfOcrHandlerSuccess:
         assert "avg_extract_per_page_ms" in timing
         assert "avg_ocr_per_page_ms" in timing
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_per_page_metadata(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
-        mock_fitz_open.return_value = _mock_document(num_pages=1, png_bytes=b"X" * 500)
+    def test_per_page_metadata(self, mock_fitz_open, mock_run):
+        mock_fitz_open.return_value = _mock_document(num_pages=1, image_bytes=_pgm(width=487, height=1))
         mock_run.return_value = _mock_subprocess_result(stdout="hello world")
 
         result = pdf_ocr_handler({"pdf": _b64_pdf()}, None)
@@ -258,10 +512,29 @@ class TestPdfOcrHandlerSuccess:
         assert page["page"] == 1
         assert page["word_count"] == 2
         assert page["image_size_bytes"] == 500
+        assert page["skipped_blank"] is False
         assert "image_extract_ms" in page
         assert "ocr_ms" in page
         assert "page_total_ms" in page
 
+    @patch("pdf_ocr_handler._get_pool")
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_sequential_path(self, mock_fitz_open, mock_run, mock_pool):
+        doc = _mock_document(num_pages=3)
+        for n, page in enumerate(doc, 1):
+            page.get_pixmap.return_value = _mock_pixmap(_pgm(n))
+        mock_fitz_open.return_value = doc
+        mock_run.return_value = _mock_subprocess_result(stdout="page 1\fpage 2\fpage 3\f")
+
+        result = pdf_ocr_handler({"pdf": _b64_pdf(), "parallel": False}, None)
+
+        mock_pool.assert_not_called()
+        # All three pages fit one batch: a single tesseract run
+        assert mock_run.call_count == 1
+        assert [p["page"] for p in result["pages"]] == [1, 2, 3]
+        assert result["text"] == "page 1\n\npage 2\n\npage 3"
+
 
 # ---------------------------------------------------------------------------
 # Tests – error handling
@@ -282,28 +555,13 @@ class TestPdfOcrHandlerErrors:
         assert "error" in result
 
     @patch("pdf_ocr_handler.fitz.open", side_effect=Exception("corrupt"))
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_fitz_failure(self, mock_tmp, mock_fitz_open):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_fitz_failure(self, mock_fitz_open):
         result = pdf_ocr_handler({"pdf": _b64_pdf()}, None)
         assert result == {"error": "corrupt"}
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_tesseract_failure_in_pipeline(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_tesseract_failure_in_pipeline(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=1)
         mock_run.return_value = _mock_subprocess_result(
             stdout="", stderr="Tesseract exploded", returncode=1
@@ -313,6 +571,48 @@ class TestPdfOcrHandlerErrors:
         assert "error" in result
         assert "Tesseract failed" in result["error"]
 
+    @patch("pdf_ocr_handler.POOL_WORKERS", 1)
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_tesseract_failure_stops_renderer(self, mock_fitz_open, mock_run):
+        """An OCR error mid-document surfaces instead of leaving the render thread blocked."""
+        mock_fitz_open.return_value = _mock_document(num_pages=10)
+        mock_run.return_value = _mock_subprocess_result(stdout="", stderr="boom", returncode=1)
+
+        result = pdf_ocr_handler({"pdf": _b64_pdf()}, None)
+
+        assert "Tesseract failed" in result["error"]
+        assert mock_run.call_count == 1
+
+
+# ---------------------------------------------------------------------------
+# Tests – JSON entry point
+# ---------------------------------------------------------------------------
+
+class TestSerialization:
+
+    @patch("pdf_ocr_handler.subprocess.run")
+    @patch("pdf_ocr_handler.fitz.open")
+    def test_json_body_matches_result(self, mock_fitz_open, mock_run):
+        mock_fitz_open.return_value = _mock_document(num_pages=1)
+        mock_run.return_value = _mock_subprocess_result(stdout="héllo wörld")
+
+        body = pdf_ocr_handler_json({"pdf": _b64_pdf(), "filename": "s.pdf"}, None)
+
+        assert isinstance(body, bytes)
+        result = json.loads(body)
+        assert result["text"] == "héllo wörld"
+        assert result["filename"] == "s.pdf"
+        assert result["pages"][0]["word_count"] == 2
+        assert set(result["timing"]) == {
+            "pipeline_ms", "total_image_extract_ms", "total_ocr_ms",
+            "avg_extract_per_page_ms", "avg_ocr_per_page_ms",
+        }
+
+    @patch("pdf_ocr_handler.orjson", None)
+    def test_stdlib_fallback(self):
+        assert json.loads(pdf_ocr_handler_json({}, None)) == {"error": "No PDF data provided"}
+
 
 # ---------------------------------------------------------------------------
 # Tests – default values
@@ -320,34 +620,18 @@ class TestPdfOcrHandlerErrors:
 
 class TestPdfOcrHandlerDefaults:
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_default_filename(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_default_filename(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=1)
         mock_run.return_value = _mock_subprocess_result(stdout="x")
 
         result = pdf_ocr_handler({"pdf": _b64_pdf()}, None)
         assert result["filename"] == "unknown.pdf"
 
-    @patch("pdf_ocr_handler.os.unlink")
     @patch("pdf_ocr_handler.subprocess.run")
     @patch("pdf_ocr_handler.fitz.open")
-    @patch("pdf_ocr_handler.tempfile.NamedTemporaryFile")
-    def test_default_dpi(self, mock_tmp, mock_fitz_open, mock_run, mock_unlink):
-        tmp_mock = MagicMock()
-        tmp_mock.name = "/tmp/fake"
-        tmp_mock.write = MagicMock()
-        mock_tmp.return_value.__enter__ = lambda s: tmp_mock
-        mock_tmp.return_value.__exit__ = MagicMock(return_value=False)
-
+    def test_default_dpi(self, mock_fitz_open, mock_run):
         mock_fitz_open.return_value = _mock_document(num_pages=1)
         mock_run.return_value = _mock_subprocess_result(stdout="x")
 
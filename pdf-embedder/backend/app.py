@@ -1,16 +1,24 @@
-import base64
+import csv
+import functools
 import io
+import itertools
+import json
 import os
+import shutil
+import tempfile
+import threading
 import time
 import uuid
+import zlib
 import mimetypes
-from typing import Dict, Any, List, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
-from flask import Flask, request, send_file, send_from_directory, jsonify
+from flask import Flask, Response, request, send_file, send_from_directory, jsonify, url_for
 from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from PIL import Image, ExifTags
+from PIL import Image, ExifTags, features
+from PIL.TiffImagePlugin import IFDRational
 
 try:
     from openpyxl import load_workbook
@@ -21,30 +29,317 @@ app = Flask(__name__, static_folder="static", static_url_path="")
 
 MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
 MAX_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Page images larger than this are listed but not decoded (decompression bombs)
+MAX_IMG_PIXELS = int(os.getenv("MAX_IMG_PIXELS", str(25_000_000)))
+_EXIF_TAGS = ExifTags.TAGS
+# JPEG headers (and so any APP1 EXIF) fit in this much of the file
+EXIF_HEAD_BYTES = 128 * 1024
+# Longest side of /api/extract preview images; downloads stay full size
+PREVIEW_MAX_DIM = int(os.getenv("PREVIEW_MAX_DIM", "1024"))
+WEBP_PREVIEWS = features.check("webp")
+# Threads building image previews for /api/extract, shared by all requests
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(8, os.cpu_count() or 1))))
+PREVIEW_POOL = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="preview")
+# Background /api/extract page walks running at once; later uploads queue
+EXTRACT_JOBS = int(os.getenv("EXTRACT_JOBS", "2"))
+EXTRACT_POOL = ThreadPoolExecutor(max_workers=EXTRACT_JOBS, thread_name_prefix="extract")
+
+# Same budget for anything Pillow opens (embed overlays, JPX/other previews):
+# past it Pillow warns, past twice it raises DecompressionBombError
+Image.MAX_IMAGE_PIXELS = MAX_IMG_PIXELS
 
-# token -> {"ts": epoch_seconds, "pdf_bytes": bytes, "attachments": {name: bytes}, "images": [{"id":..., "bytes":..., "mime":..., "page":...}]}
-STORE: Dict[str, Dict[str, Any]] = {}
 STORE_TTL_SECONDS = int(os.getenv("STORE_TTL_SECONDS", "900"))  # 15 minutes default
+STORE_DIR = os.getenv("STORE_DIR", os.path.join(tempfile.gettempdir(), "pdfemb"))
+# Expired tokens are swept from disk at most this often per process
+STORE_SWEEP_SECONDS = int(os.getenv("STORE_SWEEP_SECONDS", "60"))
 
+# How often /api/extract/stream checks a token for new images
+STREAM_POLL_SECONDS = 0.2
 
-def _too_large(content_length):
-    return content_length is not None and content_length > MAX_BYTES
+# Parsed uploads kept per process so /api/verify/extract_more can skip re-parsing
+READER_CACHE_SIZE = int(os.getenv("READER_CACHE_SIZE", "8"))
+
+# Output PDFs up to this size stay in memory; larger ones spill to a temp file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+class TokenStore:
+    """
+    Per-token results of /api/verify and /api/extract, kept on disk:
+      <basedir>/<token>/meta.json       attachment + image metadata (by name / id)
+      <basedir>/<token>/attachments/<n> attachment bytes
+      <basedir>/<token>/images/<n>.*    original / preview image bytes
+    Only metadata is held in memory (and re-read from meta.json on a miss, so
+    any worker on the host can serve a token); blobs are read or sent from
+    their files when a download/preview asks for them.
+    """
+
+    def __init__(self, basedir: str, ttl_seconds: int):
+        self.basedir = basedir
+        self.ttl_seconds = ttl_seconds
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        # Parsed readers (and the upload bytes they lazily read from), LRU
+        self._readers: "OrderedDict[str, Tuple[PdfReader, threading.Lock]]" = OrderedDict()
+        # Tokens whose background extraction runs in this process
+        self._jobs: set = set()
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(basedir, exist_ok=True)
+
+    def _dir(self, token: str) -> Optional[str]:
+        # Tokens come from the query string; only real UUIDs map to a path
+        try:
+            return os.path.join(self.basedir, str(uuid.UUID(token)))
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _write(root: str, rel: str, data: bytes) -> str:
+        path = os.path.join(root, rel)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def _write_images(self, root: str, images: List[Dict[str, Any]], start: int = 0) -> Dict[str, Dict[str, Any]]:
+        # Keyed by image id so lookups don't scan the page-ordered list
+        img_meta = {}
+        for n, im in enumerate(images, start=start):
+            original = im.get("original_bytes") or b""
+            preview = im.get("preview_bytes")
+            original_path = self._write(root, f"images/{n}.orig", original)
+            if not preview:
+                preview_path = None
+            elif preview is original:  # e.g. JPEG, previewed as-is
+                preview_path = original_path
+            else:
+                preview_path = self._write(root, f"images/{n}.preview", preview)
+            img_meta[im["id"]] = {
+                "id": im["id"],
+                "page": im["page"],
+                "name": im["name"],
+                "original_mime": im.get("original_mime"),
+                "original_path": original_path,
+                "size": len(original),
+                "preview_mime": im.get("preview_mime"),
+                "preview_path": preview_path,
+                "too_large": bool(im.get("too_large")),
+            }
+        return img_meta
+
+    def _save_meta(self, token: str, root: str, meta: Dict[str, Any]):
+        tmp = os.path.join(root, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(root, "meta.json"))
+        with self._lock:
+            self._meta[token] = meta
+
+    def put(self, attachments: Dict[str, bytes], images: List[Dict[str, Any]],
+            reader: Optional[PdfReader] = None, processing: bool = False) -> str:
+        """
+        Store a new upload's results and return its token. With processing=True
+        the images are still to come, via add_image() and then finish().
+        """
+        token = str(uuid.uuid4())
+        root = os.path.join(self.basedir, token)
+        os.makedirs(os.path.join(root, "attachments"))
+        os.makedirs(os.path.join(root, "images"))
+
+        # Attachment names are arbitrary PDF strings, so files are numbered
+        att_meta = {}
+        for n, (name, data) in enumerate(attachments.items()):
+            att_meta[name] = {
+                "path": self._write(root, f"attachments/{n}", data),
+                "size": len(data),
+                "mime": _guess_mime(name),
+            }
+
+        meta = {"ts": time.time(), "attachments": att_meta, "images": self._write_images(root, images)}
+        if processing:
+            meta["status"] = "processing"
+            with self._lock:
+                self._jobs.add(token)
+        self._save_meta(token, root, meta)
+        if reader is not None:
+            with self._lock:
+                self._readers[token] = (reader, threading.Lock())
+                while len(self._readers) > READER_CACHE_SIZE:
+                    self._readers.popitem(last=False)
+        return token
+
+    def add_images(self, token: str, images: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Store images for an existing token, replacing any it already had.
+        None if the token expired (or was swept) in the meantime.
+        """
+        meta = self.get(token)
+        if meta is None:
+            return None
+        meta = dict(meta)
+        root = self._dir(token)
+        try:
+            meta["images"] = self._write_images(root, images)
+            self._save_meta(token, root, meta)
+        except FileNotFoundError:  # swept from disk mid-write
+            return None
+        return meta
+
+    def add_image(self, token: str, image: Dict[str, Any]):
+        """Append one image to a token still being processed."""
+        with self._lock:
+            meta = self._meta[token]
+        root = self._dir(token)
+        # Swap in a new dict rather than mutating: requests may be iterating
+        # the current one (e.g. the SSE stream) while the job adds to it
+        meta = dict(meta, images={**meta["images"], **self._write_images(root, [image], start=len(meta["images"]))})
+        self._save_meta(token, root, meta)
+
+    def finish(self, token: str, error: Optional[str] = None):
+        with self._lock:
+            meta = self._meta.get(token)
+            self._jobs.discard(token)
+        if meta is None:  # expired and cleaned up mid-job
+            return
+        meta = dict(meta, status="error" if error else "done")
+        if error:
+            meta["error"] = error
+        self._save_meta(token, self._dir(token), meta)
+
+    def reader(self, token: str) -> Optional[Tuple[PdfReader, threading.Lock]]:
+        """
+        The parsed PdfReader kept from the upload, with the lock that must be
+        held while using it. Only this process has it, and only the last
+        READER_CACHE_SIZE uploads; otherwise None.
+        """
+        with self._lock:
+            entry = self._readers.get(token)
+            if entry is not None:
+                self._readers.move_to_end(token)
+        return entry
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Metadata for a live token, or None if it's unknown or expired."""
+        with self._lock:
+            meta = self._meta.get(token)
+            local = token in self._jobs
+        # Another worker's job progresses on disk, not in our cached copy
+        if meta is None or (meta.get("status") == "processing" and not local):
+            root = self._dir(token)
+            if root is None:
+                return None
+            try:
+                with open(os.path.join(root, "meta.json")) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                self._meta[token] = meta
+        if time.time() - meta["ts"] > self.ttl_seconds:
+            return None
+        return meta
+
+    def cleanup(self):
+        # Called on every request; only one of them per interval walks the disk
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < STORE_SWEEP_SECONDS:
+                return
+            self._last_sweep = now
+        try:
+            entries = list(os.scandir(self.basedir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                expired = entry.is_dir() and (now - entry.stat().st_mtime) > self.ttl_seconds
+            except FileNotFoundError:  # another worker removed it first
+                continue
+            if expired:
+                with self._lock:
+                    self._meta.pop(entry.name, None)
+                    self._readers.pop(entry.name, None)
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _read_blob(path: str, limit: int = -1) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(limit)
 
 
-def _cleanup_store():
-    now = time.time()
-    expired = [k for k, v in STORE.items() if (now - v.get("ts", now)) > STORE_TTL_SECONDS]
-    for k in expired:
-        STORE.pop(k, None)
+STORE = TokenStore(STORE_DIR, STORE_TTL_SECONDS)
 
 
+def _wants_image() -> bool:
+    """True when the client (e.g. an <img src>) prefers image bytes over the JSON preview."""
+    return request.accept_mimetypes.best_match(["application/json", "image/*"]) == "image/*"
+
+
+def _send_preview(path: str, mime: str):
+    resp = send_file(path, mimetype=mime)
+    resp.headers["Cache-Control"] = "private, max-age=60"
+    return resp
+
+
+def _too_large(content_length):
+    return content_length is not None and content_length > MAX_BYTES
+
+
+@functools.lru_cache(maxsize=1024)
 def _guess_mime(filename: str) -> str:
     mt, _ = mimetypes.guess_type(filename)
     return mt or "application/octet-stream"
 
 
+# Leading bytes of the image formats browsers render in <img>
+IMAGE_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def _sniff_mime(data: bytes) -> Optional[str]:
+    """Image mime type from the content's signature; filenames and client mimetypes can lie."""
+    for magic, mime in IMAGE_MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _pdf_from_objects(objects: List[bytes]) -> bytes:
+    """Serialize numbered objects (1..N, object 1 the catalog) into a PDF with its xref."""
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _pdf_stream(dict_entries: bytes, data: bytes) -> bytes:
+    return b"<< %s /Length %d >>\nstream\n" % (dict_entries, len(data)) + data + b"\nendstream"
+
+
+def _overlay_stream_ops(x: float, y: float, w: float, h: float) -> bytes:
+    """Content stream drawing /Im0 scaled to w x h with its lower-left corner at (x, y)."""
+    return b"q %.4f 0 0 %.4f %.4f %.4f cm /Im0 Do Q" % (w, h, x, y)
+
+
 def make_image_overlay_pdf(image_bytes, page_w, page_h, placement="top-right"):
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+    """
+    One-page PDF with the image stamped at `placement`, for merge_page().
+    Written directly rather than through a ReportLab canvas: RGB/grey JPEGs
+    are embedded as-is (/DCTDecode), anything else is decoded once and
+    stored Flate-compressed with its alpha channel as an /SMask.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
 
     target_w = page_w * 0.30
     scale = target_w / img.width
@@ -65,12 +360,36 @@ def make_image_overlay_pdf(image_bytes, page_w, page_h, placement="top-right"):
     else:
         x, y = page_w - margin - target_w, page_h - margin - target_h
 
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=(page_w, page_h))
-    c.drawImage(ImageReader(img), x, y, width=target_w, height=target_h, mask="auto")
-    c.showPage()
-    c.save()
-    return buf.getvalue()
+    extra = []
+    if img.format == "JPEG" and img.mode in ("RGB", "L"):
+        color_space = b"/DeviceRGB" if img.mode == "RGB" else b"/DeviceGray"
+        image = _pdf_stream(
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+            b"/BitsPerComponent 8 /Filter /DCTDecode" % (img.width, img.height, color_space),
+            image_bytes)
+    else:
+        img = img.convert("RGBA")
+        smask = b""
+        alpha = img.getchannel("A")
+        if alpha.getextrema() != (255, 255):
+            extra.append(_pdf_stream(
+                b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                b"/BitsPerComponent 8 /Filter /FlateDecode" % img.size,
+                zlib.compress(alpha.tobytes())))
+            smask = b" /SMask 6 0 R"
+        image = _pdf_stream(
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB "
+            b"/BitsPerComponent 8 /Filter /FlateDecode%s" % (img.width, img.height, smask),
+            zlib.compress(img.convert("RGB").tobytes()))
+
+    return _pdf_from_objects([
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] "
+        b"/Resources << /XObject << /Im0 5 0 R >> >> /Contents 4 0 R >>" % (page_w, page_h),
+        _pdf_stream(b"", _overlay_stream_ops(x, y, target_w, target_h)),
+        image,
+    ] + extra)
 
 
 def _read_attachments(reader: PdfReader) -> Dict[str, bytes]:
@@ -168,47 +487,109 @@ def _xlsx_preview(xlsx_bytes: bytes, max_rows: int = 50, max_cols: int = 20) ->
     return {"type": "table", "sheet": ws.title, "rows": normalized}
 
 
-def _csv_preview(csv_bytes: bytes, max_rows: int = 80) -> Dict[str, Any]:
+def _csv_preview(path: str, max_rows: int = 80) -> Dict[str, Any]:
     try:
-        text = csv_bytes.decode("utf-8", errors="replace")
-        lines = text.splitlines()
-        rows = [l.split(",") for l in lines[:max_rows]]
+        # Streams from the stored file: only the previewed rows are read, and
+        # csv.reader keeps quoted fields with commas/newlines intact
+        with open(path, newline="", encoding="utf-8", errors="replace") as f:
+            rows = list(itertools.islice(csv.reader(f), max_rows))
         return {"type": "table", "sheet": "CSV", "rows": rows}
     except Exception as e:
         return {"type": "error", "message": f"CSV preview failed: {e}"}
 
 
-def _exif_to_dict(img: Image.Image) -> Dict[str, Any]:
+def _jpeg_exif_segment(data: bytes) -> Optional[bytes]:
+    """
+    Walk a JPEG's header segments for the Exif APP1 payload.
+    Returns b"" when the headers end without one, None if `data` isn't a JPEG
+    or stops before the headers do.
+    """
+    if data[:3] != b"\xff\xd8\xff":
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0xDA, 0xD9):  # start of scan / end of image: no more headers
+            return b""
+        seg_len = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker == 0xE1 and data[i + 4:i + 10] == b"Exif\x00\x00":
+            if i + 2 + seg_len > len(data):
+                return None
+            return data[i + 4:i + 2 + seg_len]
+        i += 2 + seg_len
+    return None
+
+
+def _exif_from_file(path: str) -> Dict[str, Any]:
+    """
+    EXIF of a stored image. JPEG APP1 sits in the first few KB, so read only
+    that and parse it directly; anything else goes through Image.open.
+    """
+    segment = _jpeg_exif_segment(_read_blob(path, EXIF_HEAD_BYTES))
+    if segment == b"":
+        return {}
+    try:
+        if segment is not None:
+            exif = Image.Exif()
+            exif.load(segment)
+        else:
+            # EXIF is only meaningful for formats Pillow understands (usually JPEG)
+            with Image.open(path) as img:
+                exif = img.getexif()
+    except Exception:
+        return {}
+    return _exif_to_dict(exif)
+
+
+def _exif_value(value):
+    # Make sure it's JSON-friendly: decode bytes (errors="replace" can't
+    # raise), and turn TIFF rationals, which jsonify rejects, into floats;
+    # a zero denominator would give nan, which isn't valid JSON either
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, IFDRational):
+        return float(value) if value.denominator else None
+    if isinstance(value, tuple):
+        return [_exif_value(v) for v in value]
+    return value
+
+
+def _exif_to_dict(exif: Image.Exif) -> Dict[str, Any]:
     """
     Extract EXIF (if present) into a JSON-serializable dict.
     Note: Many PDF-extracted images won't contain EXIF because they may be re-encoded.
     """
     out: Dict[str, Any] = {}
     try:
-        exif = img.getexif()
         if not exif:
             return out
-        tag_map = ExifTags.TAGS
         for tag_id, value in exif.items():
-            name = tag_map.get(tag_id, str(tag_id))
-            # Make sure it's JSON-friendly
-            if isinstance(value, bytes):
-                try:
-                    value = value.decode("utf-8", errors="replace")
-                except Exception:
-                    value = base64.b64encode(value).decode("ascii")
-            out[name] = value
+            name = _EXIF_TAGS.get(tag_id) or str(tag_id)
+            out[name] = _exif_value(value)
     except Exception:
         pass
     return out
 
 
-def _extract_images_from_pdf(reader: PdfReader, max_images: int = 50) -> List[Dict[str, Any]]:
+# Filters that only compress/encode bytes; an image ending in one of these
+# decodes to raw pixel rows
+RAW_PIXEL_FILTERS = ("/FlateDecode", "/LZWDecode", "/RunLengthDecode", "/ASCII85Decode", "/ASCIIHexDecode")
+
+
+def _extract_images_from_pdf(reader: PdfReader, max_images: int = 50,
+                              on_image: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
     """
     Extract images from PDF pages by scanning XObject images.
     Produces:
       - original_bytes + original_mime (best guess)
-      - preview_bytes as PNG when we can reconstruct (for reliable browser preview)
+      - preview_bytes as PNG/WebP when we can reconstruct (for reliable browser preview)
+    on_image, if given, is called with each finished record in page order as
+    soon as it's ready, while later pages are still being scanned.
     """
     images: List[Dict[str, Any]] = []
     seen = 0
@@ -239,6 +620,105 @@ def _extract_images_from_pdf(reader: PdfReader, max_images: int = 50) -> List[Di
             return "CMYK"
         return "RGB"
 
+    def _use_webp(img):
+        # Photographic content: lossy WebP is ~10x faster to encode and far
+        # smaller than PNG. Grey/bitonal/palette images stay lossless PNG.
+        return WEBP_PREVIEWS and img.mode == "RGB" and min(img.size) >= 64
+
+    def _set_preview(rec, img):
+        # If the original is opaque (raw pixels), the download becomes a
+        # full-size PNG, so encode that before the preview is shrunk
+        if rec["original_mime"] == "application/octet-stream":
+            buf = io.BytesIO()
+            img.save(buf, format="PNG")
+            rec["name"] = f"{rec['id']}.png"
+            rec["original_mime"] = "image/png"
+            rec["original_bytes"] = buf.getvalue()
+            if max(img.size) <= PREVIEW_MAX_DIM and not _use_webp(img):
+                rec["preview_mime"] = "image/png"
+                rec["preview_bytes"] = rec["original_bytes"]
+                return
+        if max(img.size) > PREVIEW_MAX_DIM:
+            img.thumbnail((PREVIEW_MAX_DIM, PREVIEW_MAX_DIM), Image.Resampling.BILINEAR)
+        buf = io.BytesIO()
+        if _use_webp(img):
+            img.save(buf, format="WEBP", quality=80, method=0)
+            rec["preview_mime"] = "image/webp"
+        else:
+            img.save(buf, format="PNG")
+            rec["preview_mime"] = "image/png"
+        rec["preview_bytes"] = buf.getvalue()
+
+    def _build_preview(rec, data, filters, w, h, bpc, mode):
+        # JPEG: browser-friendly as-is
+        if rec["original_mime"] == "image/jpeg":
+            rec["preview_mime"] = "image/jpeg"
+            rec["preview_bytes"] = data
+            if max(w, h) > PREVIEW_MAX_DIM:
+                try:
+                    # thumbnail() drafts the JPEG first, so the decode itself
+                    # runs at 1/2..1/8 scale rather than full resolution
+                    img = Image.open(io.BytesIO(data))
+                    img.thumbnail((PREVIEW_MAX_DIM, PREVIEW_MAX_DIM), Image.Resampling.BILINEAR)
+                    if img.mode not in ("RGB", "L"):
+                        img = img.convert("RGB")
+                    buf = io.BytesIO()
+                    img.save(buf, format="JPEG", quality=85)
+                    rec["preview_bytes"] = buf.getvalue()
+                except Exception:
+                    pass
+
+        # Only transport filters (or none): decoded raw pixels -> reconstruct
+        elif not filters or filters[-1] in RAW_PIXEL_FILTERS:
+            try:
+                if w > 0 and h > 0 and bpc in (1, 8):
+                    if bpc == 1:
+                        img = Image.frombytes("1", (w, h), data).convert("L")
+                    else:
+                        channels = 1 if mode == "L" else (4 if mode == "CMYK" else 3)
+                        expected = w * h * channels
+                        if len(data) >= expected:
+                            img = Image.frombytes(mode, (w, h), data[:expected])
+                            if mode == "CMYK":
+                                img = img.convert("RGB")
+                        else:
+                            img = None
+
+                    if img is not None:
+                        _set_preview(rec, img)
+            except Exception:
+                pass
+
+        # JPXDecode: try convert to PNG if Pillow supports; otherwise no preview
+        elif rec["original_mime"] == "image/jp2":
+            try:
+                _set_preview(rec, Image.open(io.BytesIO(data)))
+            except Exception:
+                rec["preview_mime"] = None
+                rec["preview_bytes"] = None
+
+        # Anything else: attempt Pillow open -> PNG preview
+        else:
+            try:
+                _set_preview(rec, Image.open(io.BytesIO(data)))
+            except Exception:
+                pass
+
+    # pypdf reads objects through one shared stream, so the page walk stays
+    # serial; only the Pillow preview builds (GIL-free encode) run in parallel
+    pending: deque = deque()  # (rec, preview future or None), in page order
+
+    def _emit_ready(wait=False):
+        while pending and (wait or pending[0][1] is None or pending[0][1].done()):
+            rec, fut = pending.popleft()
+            if fut is not None:
+                try:
+                    fut.result()
+                except Exception:
+                    pass
+            if on_image is not None:
+                on_image(rec)
+
     for page_index, page in enumerate(reader.pages):
         if seen >= max_images:
             break
@@ -263,15 +743,16 @@ def _extract_images_from_pdf(reader: PdfReader, max_images: int = 50) -> List[Di
                     cs_name = _colorspace(o)
                     mode = _pil_mode_from_cs(cs_name)
 
-                    data = o.get_data()
-
+                    # The last filter is the image format; anything before it
+                    # (e.g. /ASCII85Decode) is undone by get_data()
+                    last_filter = filters[-1] if filters else ""
                     original_mime = "application/octet-stream"
                     original_ext = "bin"
-                    if "/DCTDecode" in filters:
+                    if last_filter == "/DCTDecode":
                         original_mime, original_ext = "image/jpeg", "jpg"
-                    elif "/JPXDecode" in filters:
+                    elif last_filter == "/JPXDecode":
                         original_mime, original_ext = "image/jp2", "jp2"
-                    elif "/CCITTFaxDecode" in filters:
+                    elif last_filter == "/CCITTFaxDecode":
                         original_mime, original_ext = "image/tiff", "tif"
 
                     img_id = f"p{page_index+1}_{seen+1}_{str(name).strip('/')}"
@@ -280,77 +761,37 @@ def _extract_images_from_pdf(reader: PdfReader, max_images: int = 50) -> List[Di
                         "page": page_index + 1,
                         "name": f"{img_id}.{original_ext}",
                         "original_mime": original_mime,
-                        "original_bytes": data,
+                        "original_bytes": b"",
                         "preview_mime": None,
                         "preview_bytes": None,
                     }
 
-                    # JPEG: browser-friendly as-is
-                    if original_mime == "image/jpeg":
-                        rec["preview_mime"] = "image/jpeg"
-                        rec["preview_bytes"] = data
-
-                    # FlateDecode or no filter: decoded raw pixels -> reconstruct
-                    elif ("/FlateDecode" in filters) or (len(filters) == 0):
-                        try:
-                            if w > 0 and h > 0 and bpc in (1, 8):
-                                if bpc == 1:
-                                    img = Image.frombytes("1", (w, h), data).convert("L")
-                                else:
-                                    channels = 1 if mode == "L" else (4 if mode == "CMYK" else 3)
-                                    expected = w * h * channels
-                                    if len(data) >= expected:
-                                        img = Image.frombytes(mode, (w, h), data[:expected])
-                                        if mode == "CMYK":
-                                            img = img.convert("RGB")
-                                    else:
-                                        img = None
-
-                                if img is not None:
-                                    buf = io.BytesIO()
-                                    img.save(buf, format="PNG")
-                                    rec["preview_mime"] = "image/png"
-                                    rec["preview_bytes"] = buf.getvalue()
-                        except Exception:
-                            pass
-
-                    # JPXDecode: try convert to PNG if Pillow supports; otherwise no preview
-                    elif original_mime == "image/jp2":
-                        try:
-                            img = Image.open(io.BytesIO(data))
-                            buf = io.BytesIO()
-                            img.save(buf, format="PNG")
-                            rec["preview_mime"] = "image/png"
-                            rec["preview_bytes"] = buf.getvalue()
-                        except Exception:
-                            rec["preview_mime"] = None
-                            rec["preview_bytes"] = None
-
-                    # Anything else: attempt Pillow open -> PNG preview
-                    else:
-                        try:
-                            img = Image.open(io.BytesIO(data))
-                            buf = io.BytesIO()
-                            img.save(buf, format="PNG")
-                            rec["preview_mime"] = "image/png"
-                            rec["preview_bytes"] = buf.getvalue()
-                        except Exception:
-                            pass
+                    # Peek at the dimensions before inflating: one huge stream can
+                    # keep pypdf busy for minutes, so list it without its bytes.
+                    # Streams that decode past the byte budget are listed the same way.
+                    data = None if w * h > MAX_IMG_PIXELS else o.get_data()
+                    if data is None or len(data) > MAX_BYTES // 4:
+                        rec["too_large"] = True
+                        images.append(rec)
+                        pending.append((rec, None))
+                        seen += 1
+                        continue
 
-                    # If we only have a PNG preview and original is opaque, set download to PNG
-                    if rec["preview_mime"] == "image/png" and rec["original_mime"] == "application/octet-stream":
-                        rec["name"] = f"{img_id}.png"
-                        rec["original_mime"] = "image/png"
-                        rec["original_bytes"] = rec["preview_bytes"] or rec["original_bytes"]
+                    rec["original_bytes"] = data
 
+                    fut = PREVIEW_POOL.submit(_build_preview, rec, data, filters, w, h, bpc, mode)
                     images.append(rec)
+                    pending.append((rec, fut))
                     seen += 1
 
                 except Exception:
                     continue
         except Exception:
             continue
+        finally:
+            _emit_ready()
 
+    _emit_ready(wait=True)
     return images
 
 
@@ -404,8 +845,7 @@ def embed():
         return jsonify({"error": f"Failed to embed attachment: {e}"}), 500
 
     # If image, also stamp onto first page
-    name_lower = extra_name.lower()
-    is_image = name_lower.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")) or (extra_file.mimetype or "").startswith("image/")
+    is_image = _sniff_mime(extra_bytes) is not None
     if is_image and len(writer.pages) > 0:
         placement = request.form.get("placement", "top-right")
         first = writer.pages[0]
@@ -417,7 +857,9 @@ def embed():
         except Exception as e:
             return jsonify({"error": f"Embedded attachment but failed to stamp image: {e}"}), 500
 
-    out = io.BytesIO()
+    # Spooled so a large output PDF goes to disk instead of sitting in RAM
+    # for the whole response; send_file closes it when the response is done.
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
     writer.write(out)
     out.seek(0)
 
@@ -426,7 +868,7 @@ def embed():
 
 @app.post("/api/verify")
 def verify():
-    _cleanup_store()
+    STORE.cleanup()
 
     if _too_large(request.content_length):
         return jsonify({"error": f"Upload too large (max {MAX_UPLOAD_MB} MB)."}), 413
@@ -438,11 +880,12 @@ def verify():
     if not pdf_bytes:
         return jsonify({"error": "PDF is empty"}), 400
 
+    # The reader keeps its BytesIO (pypdf reads streams lazily), so holding
+    # on to it lets /api/verify/extract_more skip re-uploading and re-parsing
     reader = PdfReader(io.BytesIO(pdf_bytes))
     attachments = _read_attachments(reader)
 
-    token = str(uuid.uuid4())
-    STORE[token] = {"ts": time.time(), "pdf_bytes": pdf_bytes, "attachments": attachments, "images": []}
+    token = STORE.put(attachments, [], reader=reader)
 
     items = []
     for name, b in attachments.items():
@@ -457,53 +900,61 @@ def verify():
 
 @app.get("/api/verify/attachment")
 def verify_attachment():
-    _cleanup_store()
+    STORE.cleanup()
     token = request.args.get("token", "")
     name = request.args.get("name", "")
 
-    if not token or token not in STORE:
+    meta = STORE.get(token) if token else None
+    if meta is None:
         return jsonify({"error": "Invalid/expired token. Re-upload PDF to verify again."}), 400
 
-    attachments = STORE[token].get("attachments", {})
-    if name not in attachments:
+    att = meta["attachments"].get(name)
+    if att is None:
         return jsonify({"error": "Attachment not found in this PDF."}), 404
 
-    data = attachments[name]
-    mt = _guess_mime(name)
-    return send_file(io.BytesIO(data), as_attachment=True, download_name=name, mimetype=mt)
+    # inline=1 serves it for <img src> in the preview pane instead of a download;
+    # only real images are rendered in-page, anything else stays a download
+    if request.args.get("inline") == "1":
+        sniffed = _sniff_mime(_read_blob(att["path"], 12))
+        if sniffed:
+            return _send_preview(att["path"], sniffed)
+    return send_file(att["path"], as_attachment=True, download_name=name, mimetype=att["mime"])
 
 
 @app.get("/api/verify/preview")
 def verify_preview():
-    _cleanup_store()
+    STORE.cleanup()
     token = request.args.get("token", "")
     name = request.args.get("name", "")
 
-    if not token or token not in STORE:
+    meta = STORE.get(token) if token else None
+    if meta is None:
         return jsonify({"type": "error", "message": "Invalid/expired token. Re-upload PDF to verify again."}), 400
 
-    attachments = STORE[token].get("attachments", {})
-    if name not in attachments:
+    att = meta["attachments"].get(name)
+    if att is None:
         return jsonify({"type": "error", "message": "Attachment not found in this PDF."}), 404
 
-    data = attachments[name]
     lower = name.lower()
-    mime = _guess_mime(name)
+    mime = att["mime"]
 
-    if lower.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")) or mime.startswith("image/"):
-        b64 = base64.b64encode(data).decode("ascii")
-        return jsonify({"type": "image", "mime": mime, "dataUrl": f"data:{mime};base64,{b64}"})
+    sniffed = _sniff_mime(_read_blob(att["path"], 12))
+    if sniffed and _wants_image():
+        return _send_preview(att["path"], sniffed)
+    if sniffed:
+        url = url_for("verify_attachment", token=token, name=name, inline="1")
+        return jsonify({"type": "image", "mime": sniffed, "url": url})
 
     if lower.endswith((".xlsx", ".xlsm")):
-        return jsonify(_xlsx_preview(data))
+        return jsonify(_xlsx_preview(_read_blob(att["path"])))
 
     if lower.endswith(".csv"):
-        return jsonify(_csv_preview(data))
+        return jsonify(_csv_preview(att["path"]))
 
     return jsonify({
         "type": "info",
         "name": name,
-        "size": len(data),
+        "size": att["size"],
         "mime": mime,
         "message": "No built-in preview for this file type. You can still download it."
     })
@@ -517,8 +968,10 @@ def extract():
       - Embedded file attachments (EmbeddedFiles NameTree)
       - Inline/page images (XObject images)
     Returns a token to download/preview extracted images and attachments.
+    Images are extracted in the background; follow /api/extract/stream for
+    them as they finish.
     """
-    _cleanup_store()
+    STORE.cleanup()
 
     if _too_large(request.content_length):
         return jsonify({"error": f"Upload too large (max {MAX_UPLOAD_MB} MB)."}), 413
@@ -534,13 +987,90 @@ def extract():
     info = _pdf_info(reader)
 
     attachments = _read_attachments(reader)
-    images = _extract_images_from_pdf(reader)
 
-    token = str(uuid.uuid4())
-    STORE[token] = {"ts": time.time(), "pdf_bytes": pdf_bytes, "attachments": attachments, "images": images}
+    token = STORE.put(attachments, [], processing=True)
+    # The job owns the reader from here on (pypdf readers aren't thread-safe)
+    EXTRACT_POOL.submit(_extract_job, token, reader)
 
     att_list = [{"name": n, "size": len(b), "mime": _guess_mime(n)} for n, b in attachments.items()]
-    img_list = [{"id": im["id"], "name": im["name"], "page": im["page"], "mime": im.get("original_mime"), "size": len(im.get("original_bytes") or b"")} for im in images]
+
+    return jsonify({
+        "token": token,
+        "status": "processing",
+        "stream": url_for("extract_stream", token=token),
+        "pdf_metadata": info,
+        "attachment_count": len(att_list),
+        "attachments": sorted(att_list, key=lambda x: x["name"].lower()),
+    })
+
+
+def _extract_job(token: str, reader: PdfReader):
+    try:
+        _extract_images_from_pdf(reader, on_image=lambda rec: STORE.add_image(token, rec))
+    except Exception as e:
+        STORE.finish(token, error=str(e))
+    else:
+        STORE.finish(token)
+
+
+def _image_listing(im: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": im["id"], "name": im["name"], "page": im["page"], "mime": im.get("original_mime"), "size": im["size"]}
+
+
+@app.get("/api/extract/stream")
+def extract_stream():
+    """
+    Server-Sent Events for a token's background extraction: one message per
+    image as it's stored, then a "done" event with the count (and any error).
+    """
+    token = request.args.get("token", "")
+    if not token or STORE.get(token) is None:
+        return jsonify({"error": "Invalid/expired token. Re-upload PDF to extract again."}), 400
+
+    def events():
+        sent = 0
+        while True:
+            meta = STORE.get(token)
+            if meta is None:
+                yield "event: done\ndata: %s\n\n" % json.dumps({"image_count": sent, "error": "Token expired."})
+                return
+            images = list(meta["images"].values())
+            for im in images[sent:]:
+                yield "data: %s\n\n" % json.dumps(_image_listing(im))
+            sent = len(images)
+            if meta.get("status") != "processing":
+                yield "event: done\ndata: %s\n\n" % json.dumps({"image_count": sent, "error": meta.get("error")})
+                return
+            time.sleep(STREAM_POLL_SECONDS)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/verify/extract_more")
+def verify_extract_more():
+    """
+    Run the /api/extract metadata + image pass on a PDF already uploaded to
+    /api/verify, reusing its parsed reader. Images are added to the same token.
+    """
+    STORE.cleanup()
+    token = request.values.get("token", "")
+
+    cached = STORE.reader(token) if token and STORE.get(token) is not None else None
+    if cached is None:
+        return jsonify({"error": "Invalid/expired token. Re-upload PDF to extract again."}), 400
+
+    reader, lock = cached
+    with lock:
+        info = _pdf_info(reader)
+        images = _extract_images_from_pdf(reader)
+
+    meta = STORE.add_images(token, images)
+    if meta is None:
+        return jsonify({"error": "Invalid/expired token. Re-upload PDF to extract again."}), 400
+
+    att_list = [{"name": n, "size": a["size"], "mime": a["mime"]} for n, a in meta["attachments"].items()]
+    img_list = [_image_listing(im) for im in meta["images"].values()]
 
     return jsonify({
         "token": token,
@@ -554,58 +1084,54 @@ def extract():
 
 @app.get("/api/extract/image")
 def extract_image_download():
-    _cleanup_store()
+    STORE.cleanup()
     token = request.args.get("token", "")
     image_id = request.args.get("id", "")
 
-    if not token or token not in STORE:
+    meta = STORE.get(token) if token else None
+    if meta is None:
         return jsonify({"error": "Invalid/expired token. Re-upload PDF to extract again."}), 400
 
-    images = STORE[token].get("images", [])
-    hit = next((im for im in images if im.get("id") == image_id), None)
+    hit = meta["images"].get(image_id)
     if not hit:
         return jsonify({"error": "Image not found."}), 404
+    if hit.get("too_large"):  # listed, but its bytes were never read
+        return jsonify({"error": "Image too large to extract."}), 413
 
-    return send_file(io.BytesIO(hit.get("original_bytes") or b""), as_attachment=True, download_name=hit["name"], mimetype=(hit.get("original_mime") or "application/octet-stream"))
+    return send_file(hit["original_path"], as_attachment=True, download_name=hit["name"], mimetype=(hit.get("original_mime") or "application/octet-stream"))
 
 
 @app.get("/api/extract/image_preview")
 def extract_image_preview():
-    _cleanup_store()
+    STORE.cleanup()
     token = request.args.get("token", "")
     image_id = request.args.get("id", "")
 
-    if not token or token not in STORE:
+    meta = STORE.get(token) if token else None
+    if meta is None:
         return jsonify({"type": "error", "message": "Invalid/expired token. Re-upload PDF to extract again."}), 400
 
-    images = STORE[token].get("images", [])
-    hit = next((im for im in images if im.get("id") == image_id), None)
+    hit = meta["images"].get(image_id)
     if not hit:
         return jsonify({"type": "error", "message": "Image not found."}), 404
 
-    data = hit.get("original_bytes") or b""
     mime = hit.get("original_mime") or "application/octet-stream"
 
-    # Prefer prebuilt preview bytes (PNG/JPEG) for reliable browser display
-    pbytes = hit.get("preview_bytes")
-    pmime = hit.get("preview_mime")
+    if hit.get("preview_path") and _wants_image():
+        return _send_preview(hit["preview_path"], hit["preview_mime"])
 
-    exif = {}
-    data_url = None
+    # Parsed once per token; later previews of the same image reuse it
+    exif = hit.get("exif")
+    if exif is None:
+        exif = hit["exif"] = _exif_from_file(hit["original_path"])
 
-    try:
-        # EXIF is only meaningful for formats Pillow understands (usually JPEG)
-        img = Image.open(io.BytesIO(data))
-        exif = _exif_to_dict(img)
-    except Exception:
-        exif = {}
-
-    if pbytes and pmime:
-        b64 = base64.b64encode(pbytes).decode("ascii")
-        data_url = f"data:{pmime};base64,{b64}"
+    # Prefer prebuilt preview bytes (PNG/JPEG) for reliable browser display;
+    # the browser fetches them itself rather than inlining base64 here
+    if hit.get("preview_path") and hit.get("preview_mime"):
+        preview_url = url_for("extract_image_preview_bytes", token=token, id=image_id)
     else:
         # No safe preview
-        data_url = None
+        preview_url = None
 
     return jsonify({
         "type": "image",
@@ -614,9 +1140,26 @@ def extract_image_preview():
         "page": hit["page"],
         "mime": mime,
         "exif": exif,
-        "dataUrl": data_url
+        "url": preview_url
     })
 
 
+@app.get("/api/extract/image_preview_bytes")
+def extract_image_preview_bytes():
+    STORE.cleanup()
+    token = request.args.get("token", "")
+    image_id = request.args.get("id", "")
+
+    meta = STORE.get(token) if token else None
+    if meta is None:
+        return jsonify({"error": "Invalid/expired token. Re-upload PDF to extract again."}), 400
+
+    hit = meta["images"].get(image_id)
+    if not hit or not hit.get("preview_path"):
+        return jsonify({"error": "No preview for this image."}), 404
+
+    return _send_preview(hit["preview_path"], hit["preview_mime"])
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
\ No newline at end of file